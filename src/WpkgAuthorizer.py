@@ -0,0 +1,81 @@
+"""WpkgAuthorizer.py
+Decides if a named pipe client may execute Wpkg-GP
+"""
+from win32api import GetCurrentThread
+from win32security import *
+from ntsecuritycon import *
+import threading
+import logging
+import time
+
+# From http://msdn.microsoft.com/en-us/library/aa379649%28VS.85%29.aspx
+SID_LOCAL = "S-1-2-0"
+SID_ADMINISTRATORS = "S-1-5-32-544"
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+class WpkgAuthorizer(object):
+    # The group memberships of a client are read from its token and kept
+    # per logon session for ttl seconds. The decision itself always uses
+    # the current configuration.
+    def __init__(self, config, ttl=60):
+        self.config = config
+        self.ttl = ttl
+        self.administrators_sid = ConvertStringSidToSid(SID_ADMINISTRATORS)
+        self.local_sid = ConvertStringSidToSid(SID_LOCAL)
+        self.lock = threading.Lock()
+        self.sessions = {} # logon session id -> (time, is_local_admin, is_local_user)
+
+    def get_membership(self, handle):
+        # Returns (is_local_admin, is_local_user) of the client connected to handle
+        ImpersonateNamedPipeClient(handle)
+        try:
+            token = OpenThreadToken(GetCurrentThread(), TOKEN_QUERY, 1)
+        finally:
+            RevertToSelf()
+        try:
+            session = GetTokenInformation(token, TokenStatistics)["AuthenticationId"]
+            now = time.time()
+            with self.lock:
+                cached = self.sessions.get(session)
+            if cached != None and now - cached[0] < self.ttl:
+                logger.debug("Using cached group membership of the client")
+                return cached[1:]
+            is_local_admin = False
+            is_local_user = False
+            # PySID compares the binary SIDs, no names are looked up
+            for group_sid, attributes in GetTokenInformation(token, TokenGroups):
+                if group_sid == self.administrators_sid:
+                    is_local_admin = True
+                elif group_sid == self.local_sid:
+                    is_local_user = True
+        finally:
+            token.Close()
+        with self.lock:
+            for key in [k for k, v in self.sessions.items() if now - v[0] >= self.ttl]:
+                del self.sessions[key]
+            self.sessions[session] = (now, is_local_admin, is_local_user)
+        return is_local_admin, is_local_user
+
+    def is_allowed(self, handle):
+        logger.debug("Checking client acccess")
+        is_local_admin, is_local_user = self.get_membership(handle)
+        if is_local_admin:
+            logger.debug("Client user is a member of Administrators group, permission is granted")
+            return True
+        if self.config.get("WpkgExecuteByNonAdmins") == 1:
+            logger.debug("All users may access the service, persmission is granted")
+            return True
+        if self.config.get("WpkgExecuteByLocalUsers") == 1 and is_local_user:
+            logger.debug("Client user is local user, permission is granted")
+            return True
+        logger.debug("Permission to execute is not given.")
+        return False
+
+h = NullHandler()
+logger = logging.getLogger("WpkgService")
+logger.addHandler(h)
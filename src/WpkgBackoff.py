@@ -0,0 +1,74 @@
+"""WpkgBackoff.py
+Spreads out retries of many clients connecting to the same server
+"""
+import random
+import hashlib
+
+
+class WpkgBackoff(object):
+    # Capped exponential backoff with decorrelated jitter: every delay is
+    # random between base and three times the previous delay, at most cap.
+    # Clients failing at the same moment retry at different moments.
+    def __init__(self, base, cap, rng=random):
+        self.base = max(base, 0.001)
+        self.cap = max(cap, self.base)
+        self.rng = rng
+        self.delay = self.base
+
+    def next(self):
+        self.delay = min(self.cap, self.rng.uniform(self.base, self.delay * 3))
+        return self.delay
+
+    def reset(self):
+        self.delay = self.base
+
+
+def get_splay(hostname, max_splay):
+    # A delay between 0 and max_splay seconds, always the same for a host
+    if max_splay <= 0:
+        return 0
+    value = int(hashlib.sha1(hostname.lower()).hexdigest()[:8], 16)
+    return (value % int(max_splay * 1000)) / 1000.0
+
+
+def simulate(clients=5000, capacity=200, sleep=5, cap=60, splay=0, use_backoff=True, attempt_time=1, seed=1):
+    # Clients all start at 0 and connect to a server serving capacity
+    # connections per second. When more clients arrive in a second, the
+    # rest fail and retry. Returns (peak attempts per second, seconds until
+    # every client is connected, total attempts).
+    rng = random.Random(seed)
+    pending = []
+    for i in range(clients):
+        start = get_splay("pc-%05i" % i, splay)
+        backoff = WpkgBackoff(sleep, cap, rng)
+        pending.append((start, backoff))
+    second = 0
+    peak = 0
+    attempts = 0
+    while pending:
+        now = [p for p in pending if p[0] < second + 1]
+        later = [p for p in pending if p[0] >= second + 1]
+        peak = max(peak, len(now))
+        attempts = attempts + len(now)
+        rng.shuffle(now)
+        pending = later
+        for start, backoff in now[capacity:]:
+            if use_backoff:
+                delay = backoff.next()
+            else:
+                delay = sleep
+            pending.append((second + attempt_time + delay, backoff))
+        second = second + 1
+    return peak, second, attempts
+
+
+if __name__=='__main__':
+    import sys
+    clients = len(sys.argv) > 1 and int(sys.argv[1]) or 5000
+    capacity = len(sys.argv) > 2 and int(sys.argv[2]) or 200
+    print "%i clients, server accepts %i connections per second" % (clients, capacity)
+    print "%-28s %10s %10s %10s" % ("", "peak/s", "seconds", "attempts")
+    for name, kwargs in (("fixed sleep", {"use_backoff": False}),
+                         ("backoff with jitter", {}),
+                         ("backoff with jitter, splay", {"splay": 30})):
+        print "%-28s %10i %10i %10i" % ((name,) + simulate(clients, capacity, **kwargs))
@@ -0,0 +1,193 @@
+"""WpkgBlacklist.py
+Decides if this computer is blocked by blacklist.txt next to wpkg.js
+
+Every line of blacklist.txt is one rule, lines starting with # are
+comments:
+
+    pc-042                    Host name
+    lab-*                     Host names matching a wildcard (* and ?)
+    re:^kiosk-[0-9]+$         Host names matching a regular expression
+    10.1.0.0/16               Hosts with an address in the network
+    10.2.0.10-10.2.0.99       Hosts with an address in the range
+    !all!                     Every host
+
+The file is only read again when its size or modification time has
+changed.
+"""
+import os
+import re
+import socket
+import struct
+import bisect
+import fnmatch
+import logging
+import threading
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+# Only full dotted quads are addresses, inet_aton also accepts e.g. "2019"
+DOTTED_QUAD = re.compile(r"^(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})$")
+CIDR = re.compile(r"^(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})/(\d{1,2})$")
+
+
+def ip_to_int(address):
+    return struct.unpack("!I", socket.inet_aton(address))[0]
+
+
+def parse_address(text):
+    # Returns the address as integer, or None if text is no dotted quad
+    match = DOTTED_QUAD.match(text.strip())
+    if match == None:
+        return None
+    value = 0
+    for part in match.groups():
+        if int(part) > 255:
+            return None
+        value = value << 8 | int(part)
+    return value
+
+
+def parse_ip_range(rule):
+    # Returns (first, last) as integers, or None if rule is no address range
+    match = CIDR.match(rule)
+    if match != None:
+        address, bits = parse_address(match.group(1)), int(match.group(2))
+        if address == None or bits > 32:
+            return None
+        mask = (0xffffffff << (32 - bits)) & 0xffffffff
+        first = address & mask
+        return first, first | (~mask & 0xffffffff)
+    if rule.count("-") == 1:
+        first, last = [parse_address(address) for address in rule.split("-")]
+        if first != None and last != None and first <= last:
+            return first, last
+    return None
+
+
+def get_local_addresses():
+    try:
+        return socket.gethostbyname_ex(socket.gethostname())[2]
+    except socket.error:
+        return []
+
+
+class WpkgBlacklistRules(object):
+    # The parsed contents of one version of blacklist.txt
+    def __init__(self, lines=()):
+        self.block_all = False
+        self.names = set()
+        patterns = []
+        ranges = []
+        for line in lines:
+            rule = line.strip()
+            if rule == "" or rule.startswith("#"):
+                continue
+            if rule.lower() == "!all!":
+                # Block all systems from executing
+                self.block_all = True
+                break
+            if rule.startswith("re:"):
+                try:
+                    patterns.append("(?:%s)" % re.compile(rule[3:], re.IGNORECASE).pattern)
+                except re.error, e:
+                    logger.error("Invalid regular expression in blacklist: %s (%s)" % (rule, e))
+                continue
+            ip_range = parse_ip_range(rule)
+            if ip_range != None:
+                ranges.append(ip_range)
+                continue
+            if "*" in rule or "?" in rule:
+                patterns.append(fnmatch.translate(rule.lower()))
+            else:
+                self.names.add(rule.lower())
+        # All patterns are tried in one pass of a single expression
+        self.pattern = None
+        if patterns:
+            self.pattern = re.compile("|".join(patterns), re.IGNORECASE)
+        # Overlapping ranges are merged, so an address can only be in the
+        # range starting nearest below it
+        self.ranges = []
+        for first, last in sorted(ranges):
+            if self.ranges and first <= self.ranges[-1][1] + 1:
+                self.ranges[-1] = (self.ranges[-1][0], max(last, self.ranges[-1][1]))
+            else:
+                self.ranges.append((first, last))
+        self.range_starts = [first for first, last in self.ranges]
+
+    def in_ranges(self, address):
+        try:
+            value = ip_to_int(address)
+        except socket.error:
+            return False
+        i = bisect.bisect_right(self.range_starts, value)
+        return i > 0 and self.ranges[i - 1][1] >= value
+
+    def is_blocked(self, hostname, addresses=None):
+        if self.block_all:
+            return True
+        hostname = hostname.lower()
+        if hostname in self.names:
+            return True
+        if self.pattern != None and self.pattern.match(hostname):
+            return True
+        if self.ranges:
+            if addresses == None:
+                addresses = get_local_addresses()
+            for address in addresses:
+                if self.in_ranges(address):
+                    return True
+        return False
+
+
+class WpkgBlacklist(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stat = None
+        self.rules = WpkgBlacklistRules()
+
+    def get_rules(self):
+        # Returns the rules of the current file, parsing it only if it changed
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            # No blacklist, nothing is blocked
+            return WpkgBlacklistRules()
+        stat = (st.st_size, st.st_mtime)
+        with self.lock:
+            if stat == self.stat:
+                return self.rules
+            try:
+                with open(self.path, "r") as blacklist_file:
+                    rules = WpkgBlacklistRules(blacklist_file)
+            except IOError:
+                return WpkgBlacklistRules()
+            logger.debug("Read blacklist %s: %i names, %i ranges, block all: %s" %
+                         (self.path, len(rules.names), len(rules.ranges), rules.block_all))
+            self.stat = stat
+            self.rules = rules
+            return rules
+
+    def is_blocked(self, hostname, addresses=None):
+        return self.get_rules().is_blocked(hostname, addresses)
+
+h = NullHandler()
+logger = logging.getLogger("WpkgService")
+logger.addHandler(h)
+
+if __name__=='__main__':
+    import sys, time
+    # Compares the lookup time with the list based check used before
+    hosts = ["pc-%05i" % i for i in range(50000)]
+    rules = WpkgBlacklistRules(hosts + ["lab-*", "re:^kiosk-[0-9]+$", "10.1.0.0/16"])
+    for name, check in (("list", lambda host: host in hosts), ("rules", lambda host: rules.is_blocked(host, []))):
+        started = time.time()
+        for i in range(1000):
+            check("pc-99999")
+        print "%-6s %8.1f us per lookup" % (name, (time.time() - started) * 1000)
+    print rules.is_blocked("PC-00042", []), rules.is_blocked("lab-7", []), rules.is_blocked("kiosk-3", []), \
+        rules.is_blocked("other", ["10.1.2.3"]), rules.is_blocked("other", ["10.2.0.1"])
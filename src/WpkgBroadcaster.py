@@ -0,0 +1,119 @@
+"""WpkgBroadcaster.py
+Fans out the messages of a running task to any number of attached clients
+"""
+import threading
+import collections
+
+
+class WpkgBroadcaster(object):
+    def __init__(self, backlog=100):
+        # Messages are kept encoded, so every message is encoded only once no
+        # matter how many clients are attached. Late joiners are replayed
+        # whatever is still in the ring buffer.
+        self.cond = threading.Condition()
+        self.backlog = backlog
+        self.messages = collections.deque(maxlen=backlog)
+        self.seq = 0
+        self.run = 0
+        self.active = False
+        # [(writer, done)] of the attached clients, fed by publish() so no
+        # thread waits for them
+        self.attached = []
+
+    def start(self, keep_all=False):
+        # keep_all keeps every message of the task for late joiners, for
+        # short tasks like a query
+        with self.cond:
+            if keep_all:
+                self.messages = collections.deque()
+            else:
+                self.messages = collections.deque(maxlen=self.backlog)
+            self.run = self.run + 1
+            self.active = True
+            self.detach_all()
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.active = False
+            self.detach_all()
+            self.cond.notify_all()
+
+    def publish(self, data):
+        with self.cond:
+            self.seq = self.seq + 1
+            self.messages.append((self.seq, data))
+            if self.attached:
+                self.attached = [(writer, done) for writer, done in self.attached
+                                 if self.forward(writer, done, data)]
+            self.cond.notify_all()
+
+    def forward(self, writer, done, data):
+        # Returns False once the client is gone
+        if writer.closed:
+            writer.close_async(done)
+            return False
+        writer.WriteEncoded(data)
+        return True
+
+    def attach(self, writer, done=None):
+        # Streams the messages of the running task to writer, done is called
+        # once the last message is written. Returns False if no task is
+        # running.
+        with self.cond:
+            if not self.active:
+                return False
+            for seq, data in self.messages:
+                writer.WriteEncoded(data)
+            self.attached.append((writer, done))
+            return True
+
+    def detach_all(self):
+        for writer, done in self.attached:
+            writer.close_async(done)
+        self.attached = []
+
+    def last_message(self):
+        with self.cond:
+            if self.messages:
+                return self.messages[-1][1]
+            return None
+
+    def subscribe(self):
+        # Returns None if no task is running
+        with self.cond:
+            if not self.active:
+                return None
+            return WpkgSubscription(self)
+
+
+class WpkgSubscription(object):
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+        self.run = broadcaster.run
+        if broadcaster.messages:
+            self.cursor = broadcaster.messages[0][0] - 1
+        else:
+            self.cursor = broadcaster.seq
+        self.missed = 0
+
+    def get(self, timeout=None):
+        # Returns a list of messages not yet seen by this subscriber, an empty
+        # list on timeout, or None when the task has finished and everything
+        # has been delivered.
+        b = self.broadcaster
+        with b.cond:
+            while self.cursor == b.seq and b.active and b.run == self.run:
+                b.cond.wait(timeout)
+                if timeout != None:
+                    break
+            if b.run != self.run:
+                return None
+            messages = [data for seq, data in b.messages if seq > self.cursor]
+            if b.messages and b.messages[0][0] > self.cursor + 1:
+                # The subscriber fell behind the ring buffer
+                self.missed = self.missed + b.messages[0][0] - self.cursor - 1
+            self.cursor = b.seq
+            if not messages and not b.active:
+                return None
+            return messages
@@ -1,212 +1,406 @@
-import configobj
-import _winreg
-import os.path
-import base64
-import logging
-import win32crypt, pywintypes
-import re
-import datetime
-
-class NullHandler(logging.Handler):
-    def emit(self, record):
-        pass
-
-class WpkgConfigError(Exception):
-    def __init__(self, value):
-        self.value = value
-    def __str__(self):
-        return repr(self.value)
-
-class WpkgConfig(object):
-    regkey = "Software\Policies\WPKG_GP"
-    def __init__(self):
-        with _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, R"SOFTWARE\Wpkg-GP", 0, _winreg.KEY_READ) as key:
-            self.install_path = _winreg.QueryValueEx(key, "InstallPath")[0]
-        self.inifile = os.path.join(self.install_path, "Wpkg-GP.ini")
-        # list_values needs to be False to preserve quotes from single values
-        self.configobj = configobj.ConfigObj(self.inifile, list_values = False)
-        self.WpkgConfig = self.configobj["WpkgConfig"]
-        try:
-            self.ignore_policy = int(self.WpkgConfig["IgnoreGroupPolicy"])
-        except KeyError:
-            self.ignore_policy = 0
-        self.EnvironmentVariables = WpkgEnvironmentVariables(self)
-        
-        self.settings = [
-            WpkgSetting(self, "WpkgCommand", None, "string", True),
-            WpkgSetting(self, "WpkgVerbosity", 1, "int"),
-            WpkgSetting(self, "WpkgMaxReboots", 10, "int"),
-            WpkgSetting(self, "WpkgRebootPolicy", "force"),
-            WpkgSetting(self, "WpkgTimeout", 15, "int"),
-            WpkgSetting(self, "InstallOnShutdown", 1, "int"),
-            WpkgSetting(self, "EnableViaLGP", 1, "int"),
-            WpkgSetting(self, "WpkgNetworkUsername"),
-            WpkgPasswordSetting(self, "WpkgNetworkPassword", None, "password"),
-            WpkgSetting(self, "WpkgExecuteByNonAdmins", 0, "int"),
-            WpkgSetting(self, "WpkgExecuteByLocalUsers", 1, "int"),
-            WpkgSetting(self, "WpkgActivityIndicator", 1, "int"),
-            WpkgSetting(self, "DisableAtBootUp", 0, "int"),
-            WpkgSetting(self, "TestConnectionHost", None, "string"),
-            WpkgSetting(self, "TestConnectionPort", 445, "string"),
-            WpkgSetting(self, "TestConnectionTries", 5, "int"),
-            WpkgSetting(self, "TestConnectionSleepBeforeRetry", 2, "int"),
-            WpkgSetting(self, "ConnectionTries", 7, "int"),
-            WpkgSetting(self, "ConnectionSleepBeforeRetry", 5, "int")
-            ]
-    def get(self, name):
-        for i in self.settings:
-            if i.name == name:
-                return i.get()
-    def set(self, name, new_value):
-        for i in self.settings:
-            if i.name == name:
-                i.set(new_value)
-
-    def set_wpkg_runningstate(self, state):
-        with _winreg.CreateKeyEx(_winreg.HKEY_LOCAL_MACHINE, R"SOFTWARE\WPKG", 0,
-                                 _winreg.KEY_ALL_ACCESS | _winreg.KEY_WOW64_64KEY) as key:
-            _winreg.SetValueEx(key, "running", 0, _winreg.REG_SZ, state)
-
-    def set_wpkg_synctime(self):
-        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with _winreg.CreateKeyEx(_winreg.HKEY_LOCAL_MACHINE, R"SOFTWARE\WPKG", 0,
-                                 _winreg.KEY_ALL_ACCESS | _winreg.KEY_WOW64_64KEY) as key:
-            _winreg.SetValueEx(key, "lastsync", 0, _winreg.REG_SZ, current_time)
-
-    def get_codepage(self):
-        try:
-            key = _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, R"SYSTEM\CurrentControlSet\Control\Nls\CodePage", 0,
-                                  _winreg.KEY_READ | _winreg.KEY_WOW64_64KEY)
-            codepage = _winreg.QueryValueEx(key, "OEMCP")[0]
-            _winreg.CloseKey(key)
-        except WindowsError:
-            print 'Registy Error: Can\'t read codepage'
-            codepage = '1252'
-        return 'cp' + codepage
-
-class WpkgSetting(object):
-    def __init__(self, caller, name, default_value = None, type = "string", required = False):
-        self.caller = caller
-        self.name = name
-        self.default_value = default_value
-        self.type = type
-        self.required = required
-
-    def get_from_ini(self, log=True):
-        try:
-            ini_config =  self.caller.WpkgConfig[self.name]
-        except KeyError:
-            return None
-        if ini_config == "":
-            return None
-        else:
-            if log:
-                logger.debug("Config: Reading %s: '%s' from ini file" % (self.name, ini_config))
-            if self.type == "int":
-                return int(ini_config)
-            else:
-                return ini_config
-    
-    def get_from_policy(self, log=True):
-        try:
-            with _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, self.caller.regkey) as key:
-                policy_config = _winreg.QueryValueEx(key, self.name)[0]
-                if log:
-                    logger.debug("Config:Reading %s: '%s' from group policy settings" % (self.name, policy_config))
-                if self.type == "int":
-                    return int(policy_config)
-                else:
-                    return policy_config
-        except WindowsError:
-            return None
-
-    def get(self):
-        if self.caller.ignore_policy != 1:
-            policy_value = self.get_from_policy()
-            if policy_value != None:
-                return policy_value
-        ini_value = self.get_from_ini()
-        if ini_value != None:
-            return ini_value
-        if self.required == True and self.default_value == None:
-            raise WpkgConfigError("The setting %s is required, but no value set by policy or in ini file" % self.name)
-        else:
-            logger.debug("Config: Returning default value %s: '%s' as it is not configured" % (self.name, self.default_value))
-            return self.default_value
-    
-    def set(self, new_value):
-        value = new_value
-        self.caller.WpkgConfig[self.name] = value
-        self.caller.confobj.write()
-
-class WpkgPasswordSetting(WpkgSetting):
-    def get(self):
-        if self.caller.ignore_policy != "1":
-            policy_value = self.get_from_policy(log=False)
-            if policy_value != None:
-                logger.debug("Reading %s from group policy settings" % self.name)
-                return policy_value
-        ini_value = self.get_from_ini(log=False)
-        if ini_value != None:
-            ini_value = re.sub(r'^"|"$', '', ini_value)   # remove possible quotes
-            logger.debug("Reading %s from ini file" % self.name)
-            self.passwordtype = ini_value.split(":")[0]
-            value = ":".join(ini_value.split(":")[1:])
-            if self.passwordtype == "clear":
-                # Encrypt the password
-                self.set(value)
-                return value
-            elif self.passwordtype == "crypt":
-                #Remove base_64
-                if value[-1] == "#": # If an extra # has been added to the hash to force quoting
-                    encrypted_password = base64.b64decode(value[:-1]) # Remove hash at end
-                else:
-                    encrypted_password = base64.b64decode(value)
-                password = win32crypt.CryptUnprotectData(encrypted_password, None, None, None, 0)[1]
-                return password
-            else:
-                raise WpkgConfigError("The password type %s is invalid, provide either 'clear:password' or 'crypt:encryptedpassword'" % self.passwordtype)
-        else:
-            return None
-    def set(self, new_value):
-        encrypted_password = win32crypt.CryptProtectData(new_value, "Password", None, None, None, 0)
-        base64_password = base64.b64encode(encrypted_password)
-        # Add hash at end to force qouting by configobj module
-        value = 'crypt:%s#' % base64_password
-        self.caller.WpkgConfig[self.name] = value
-        self.caller.configobj.write()
-
-class WpkgEnvironmentVariables(object):
-    def __init__(self, caller):
-        self.caller = caller
-    def get(self):
-        config = self.caller.configobj
-        try:
-            logger.debug("Reading EnvironmentVariables from ini file")
-            for k, v in config['EnvironmentVariables'].items():
-                logger.debug("EnvrionmentVariable %s is '%s'" % (k, v))
-            return config['EnvironmentVariables']
-        except KeyError:
-            logger.debug("EnvironmentVariables section not configured in ini file")
-
-
-def main():
-    config = WpkgConfig()
-    print config.EnvironmentVariables.get()
-        
-    for setting in config.settings:
-        print "%s is %s" % (setting.name, setting.get())
-
-if __name__=='__main__':
-    import sys
-    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")                        
-    h = logging.StreamHandler(sys.stdout)
-    h.setFormatter(formatter)
-    logger = logging.getLogger("WpkgConfig")
-    logger.addHandler(h)
-    logger.setLevel(logging.DEBUG)
-    main()
-else:
-    h = NullHandler()
-    logger = logging.getLogger("WpkgService")
-    logger.addHandler(h)
+import configobj
+import _winreg
+import os.path
+import base64
+import logging
+import win32crypt, pywintypes
+import re
+import datetime
+import time
+import hashlib
+import threading
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+class WpkgConfigError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+POLICY_KEY = R"Software\Policies\WPKG_GP"
+# Seconds between two checks of the ini file and the policy key for changes
+CHECK_INTERVAL = 5
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_reload_listeners = []
+
+
+def get_snapshot():
+    # Returns the current configuration, shared by the whole process. A new
+    # snapshot is read when the ini file or the policy key has changed.
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot != None and time.time() - snapshot.checked < CHECK_INTERVAL:
+        return snapshot
+    reloaded = False
+    with _snapshot_lock:
+        if _snapshot is snapshot:
+            if snapshot == None:
+                _snapshot = WpkgConfigSnapshot()
+            elif snapshot.changed():
+                try:
+                    _snapshot = WpkgConfigSnapshot()
+                    reloaded = True
+                except Exception:
+                    # E.g. an ini file being edited, the last good settings
+                    # are kept until it can be read
+                    logger.exception("Error reading the changed configuration, keeping the current settings:")
+                    snapshot.checked = time.time()
+            else:
+                snapshot.checked = time.time()
+        snapshot = _snapshot
+    if reloaded:
+        logger.info("Configuration changed, settings reloaded")
+        for callback in list(_reload_listeners):
+            try:
+                callback(snapshot)
+            except Exception:
+                logger.exception("Error when applying reloaded configuration:")
+    return snapshot
+
+
+def invalidate():
+    # Forces reading the configuration again on the next access
+    snapshot = _snapshot
+    if snapshot != None:
+        snapshot.checked = 0
+        snapshot.ini_mtime = None
+
+
+def add_reload_listener(callback):
+    # callback(snapshot) is called after the configuration has been reloaded
+    _reload_listeners.append(callback)
+
+
+def read_policy():
+    # Returns all values of the policy key and the time it was last written,
+    # with one enumeration of the key
+    try:
+        with _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, POLICY_KEY) as key:
+            subkeys, count, modified = _winreg.QueryInfoKey(key)
+            values = {}
+            for i in range(count):
+                name, value, type = _winreg.EnumValue(key, i)
+                values[name] = value
+            return values, modified
+    except WindowsError:
+        return {}, None
+
+
+def get_policy_modified():
+    try:
+        with _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, POLICY_KEY) as key:
+            return _winreg.QueryInfoKey(key)[2]
+    except WindowsError:
+        return None
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class WpkgConfigSnapshot(object):
+    # The ini file and the group policy settings as read at one point in
+    # time. Resolved values are kept, so every setting is looked up and
+    # every password decrypted only once per snapshot.
+    def __init__(self):
+        with _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, R"SOFTWARE\Wpkg-GP", 0, _winreg.KEY_READ) as key:
+            self.install_path = _winreg.QueryValueEx(key, "InstallPath")[0]
+        self.inifile = os.path.join(self.install_path, "Wpkg-GP.ini")
+        self.checked = time.time()
+        self.ini_mtime = get_mtime(self.inifile)
+        self.policy, self.policy_modified = read_policy()
+        # list_values needs to be False to preserve quotes from single values
+        self.configobj = configobj.ConfigObj(self.inifile, list_values = False)
+        self.ini = dict(self.configobj["WpkgConfig"])
+        try:
+            self.environment = dict(self.configobj["EnvironmentVariables"])
+        except KeyError:
+            self.environment = None
+        try:
+            self.ignore_policy = int(self.ini["IgnoreGroupPolicy"])
+        except KeyError:
+            self.ignore_policy = 0
+        self.settings = [
+            WpkgSetting(self, "WpkgCommand", None, "string", True),
+            WpkgSetting(self, "WpkgVerbosity", 1, "int"),
+            WpkgSetting(self, "WpkgMaxReboots", 10, "int"),
+            WpkgSetting(self, "WpkgRebootPolicy", "force"),
+            WpkgSetting(self, "WpkgTimeout", 0, "int"),
+            WpkgSetting(self, "WpkgRunTimeout", 240, "int"),
+            WpkgSetting(self, "WpkgPackageTimeout", 0, "int"),
+            WpkgSetting(self, "InstallOnShutdown", 1, "int"),
+            WpkgSetting(self, "EnableViaLGP", 1, "int"),
+            WpkgSetting(self, "WpkgNetworkUsername"),
+            WpkgPasswordSetting(self, "WpkgNetworkPassword", None, "password"),
+            WpkgSetting(self, "WpkgExecuteByNonAdmins", 0, "int"),
+            WpkgSetting(self, "WpkgExecuteByLocalUsers", 1, "int"),
+            WpkgSetting(self, "WpkgActivityIndicator", 1, "int"),
+            WpkgSetting(self, "DisableAtBootUp", 0, "int"),
+            WpkgSetting(self, "TestConnectionHost", None, "string"),
+            WpkgSetting(self, "TestConnectionPort", 445, "string"),
+            WpkgSetting(self, "TestConnectionTries", 5, "int"),
+            WpkgSetting(self, "TestConnectionSleepBeforeRetry", 2, "int"),
+            WpkgSetting(self, "ConnectionTries", 7, "int"),
+            WpkgSetting(self, "ConnectionSleepBeforeRetry", 5, "int"),
+            WpkgSetting(self, "ConnectionMaxSleepBeforeRetry", 60, "int"),
+            WpkgSetting(self, "ConnectionSplay", 0, "int"),
+            WpkgSetting(self, "ShareIdleTimeout", 120, "int"),
+            WpkgSetting(self, "LogonFailureTTL", 600, "int"),
+            WpkgSetting(self, "WpkgMirrors", None, "string"),
+            WpkgSetting(self, "WpkgMirrorsTTL", 3600, "int"),
+            WpkgSetting(self, "HistoryDays", 90, "int"),
+            WpkgSetting(self, "ShowEstimates", 1, "int"),
+            WpkgSetting(self, "EstimatorSeedFile", None, "string"),
+            WpkgSetting(self, "PipeInstances", 4, "int"),
+            WpkgSetting(self, "PipeWorkerThreads", 16, "int"),
+            WpkgSetting(self, "PipeQueueLength", 64, "int"),
+            WpkgSetting(self, "RunLogsToKeep", 20, "int"),
+            WpkgSetting(self, "RunTimingsToKeep", 10, "int"),
+            WpkgSetting(self, "LogFileSize", 1024, "int"),
+            WpkgSetting(self, "LogTotalSize", 20480, "int"),
+            WpkgSetting(self, "QueryCacheTTL", 300, "int"),
+            WpkgSetting(self, "SkipUnchangedAtBootUp", 0, "int"),
+            WpkgSetting(self, "SkipUnchangedMaxAge", 24, "int"),
+            WpkgSetting(self, "QueryEngine", "cscript")
+            ]
+        self.index = dict((setting.name, setting) for setting in self.settings)
+        self.values = {}
+
+    def changed(self):
+        return get_mtime(self.inifile) != self.ini_mtime or get_policy_modified() != self.policy_modified
+
+    def key(self):
+        # Changes with any value of the ini file or the policy key
+        digest = hashlib.sha1()
+        for values in (self.ini, self.environment or {}, self.policy):
+            for item in sorted(values.items()):
+                digest.update("\0%r" % (item,))
+            digest.update("\1")
+        return digest.hexdigest()
+
+    def get(self, name):
+        try:
+            return self.values[name]
+        except KeyError:
+            pass
+        setting = self.index.get(name)
+        if setting == None:
+            return None
+        value = self.values[name] = setting.get()
+        return value
+
+    def write_ini(self, name, value):
+        # Writes to a fresh copy of the ini file, the change is picked up
+        # by the next snapshot
+        config = configobj.ConfigObj(self.inifile, list_values = False)
+        config["WpkgConfig"][name] = value
+        config.write()
+        invalidate()
+
+
+class WpkgConfig(object):
+    # Every instance reads from the shared snapshot
+    regkey = POLICY_KEY
+    def __init__(self):
+        get_snapshot()
+        self.EnvironmentVariables = WpkgEnvironmentVariables(self)
+
+    @property
+    def snapshot(self):
+        return get_snapshot()
+
+    @property
+    def install_path(self):
+        return self.snapshot.install_path
+
+    @property
+    def inifile(self):
+        return self.snapshot.inifile
+
+    @property
+    def settings(self):
+        return self.snapshot.settings
+
+    def get(self, name):
+        return self.snapshot.get(name)
+
+    def set(self, name, new_value):
+        setting = self.snapshot.index.get(name)
+        if setting != None:
+            setting.set(new_value)
+
+    def set_wpkg_runningstate(self, state):
+        with _winreg.CreateKeyEx(_winreg.HKEY_LOCAL_MACHINE, R"SOFTWARE\WPKG", 0,
+                                 _winreg.KEY_ALL_ACCESS | _winreg.KEY_WOW64_64KEY) as key:
+            _winreg.SetValueEx(key, "running", 0, _winreg.REG_SZ, state)
+
+    def set_wpkg_synctime(self):
+        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with _winreg.CreateKeyEx(_winreg.HKEY_LOCAL_MACHINE, R"SOFTWARE\WPKG", 0,
+                                 _winreg.KEY_ALL_ACCESS | _winreg.KEY_WOW64_64KEY) as key:
+            _winreg.SetValueEx(key, "lastsync", 0, _winreg.REG_SZ, current_time)
+
+    def get_last_fingerprint(self):
+        # Returns (fingerprint, time, configuration key) of the last
+        # successful run
+        try:
+            with _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, R"SOFTWARE\WPKG-gp", 0, _winreg.KEY_READ) as key:
+                fingerprint, timestamp, config_key = _winreg.QueryValueEx(key, "LastFingerprint")[0].split(" ")
+                return fingerprint, float(timestamp), config_key
+        except (WindowsError, ValueError):
+            return None, 0, None
+
+    def set_last_fingerprint(self, fingerprint, config_key=None):
+        if fingerprint == None:
+            value = ""
+        else:
+            value = "%s %i %s" % (fingerprint, time.time(), config_key)
+        with _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, R"SOFTWARE\WPKG-gp", 0, _winreg.KEY_ALL_ACCESS) as key:
+            _winreg.SetValueEx(key, "LastFingerprint", 0, _winreg.REG_SZ, value)
+
+    def set_watchdog_result(self, reason, package):
+        # Records the package a run was stopped on, empty if it was not stopped
+        if reason == None:
+            value = ""
+        else:
+            value = "%s %i %s" % (reason, time.time(), package or "")
+        with _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, R"SOFTWARE\WPKG-gp", 0, _winreg.KEY_ALL_ACCESS) as key:
+            _winreg.SetValueEx(key, "StalledPackage", 0, _winreg.REG_SZ, value)
+
+    def get_codepage(self):
+        try:
+            key = _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, R"SYSTEM\CurrentControlSet\Control\Nls\CodePage", 0,
+                                  _winreg.KEY_READ | _winreg.KEY_WOW64_64KEY)
+            codepage = _winreg.QueryValueEx(key, "OEMCP")[0]
+            _winreg.CloseKey(key)
+        except WindowsError:
+            print 'Registy Error: Can\'t read codepage'
+            codepage = '1252'
+        return 'cp' + codepage
+
+class WpkgSetting(object):
+    def __init__(self, caller, name, default_value = None, type = "string", required = False):
+        self.caller = caller
+        self.name = name
+        self.default_value = default_value
+        self.type = type
+        self.required = required
+
+    def get_from_ini(self, log=True):
+        ini_config = self.caller.ini.get(self.name)
+        if ini_config == None or ini_config == "":
+            return None
+        else:
+            if log:
+                logger.debug("Config: Reading %s: '%s' from ini file", self.name, ini_config)
+            if self.type == "int":
+                return int(ini_config)
+            else:
+                return ini_config
+    
+    def get_from_policy(self, log=True):
+        policy_config = self.caller.policy.get(self.name)
+        if policy_config == None:
+            return None
+        if log:
+            logger.debug("Config:Reading %s: '%s' from group policy settings", self.name, policy_config)
+        if self.type == "int":
+            return int(policy_config)
+        else:
+            return policy_config
+
+    def get(self):
+        if self.caller.ignore_policy != 1:
+            policy_value = self.get_from_policy()
+            if policy_value != None:
+                return policy_value
+        ini_value = self.get_from_ini()
+        if ini_value != None:
+            return ini_value
+        if self.required == True and self.default_value == None:
+            raise WpkgConfigError("The setting %s is required, but no value set by policy or in ini file" % self.name)
+        else:
+            logger.debug("Config: Returning default value %s: '%s' as it is not configured" % (self.name, self.default_value))
+            return self.default_value
+    
+    def set(self, new_value):
+        self.caller.write_ini(self.name, new_value)
+
+class WpkgPasswordSetting(WpkgSetting):
+    def get(self):
+        if self.caller.ignore_policy != 1:
+            policy_value = self.get_from_policy(log=False)
+            if policy_value != None:
+                logger.debug("Reading %s from group policy settings" % self.name)
+                return policy_value
+        ini_value = self.get_from_ini(log=False)
+        if ini_value != None:
+            ini_value = re.sub(r'^"|"$', '', ini_value)   # remove possible quotes
+            logger.debug("Reading %s from ini file" % self.name)
+            self.passwordtype = ini_value.split(":")[0]
+            value = ":".join(ini_value.split(":")[1:])
+            if self.passwordtype == "clear":
+                # Encrypt the password
+                self.set(value)
+                return value
+            elif self.passwordtype == "crypt":
+                #Remove base_64
+                if value[-1] == "#": # If an extra # has been added to the hash to force quoting
+                    encrypted_password = base64.b64decode(value[:-1]) # Remove hash at end
+                else:
+                    encrypted_password = base64.b64decode(value)
+                password = win32crypt.CryptUnprotectData(encrypted_password, None, None, None, 0)[1]
+                return password
+            else:
+                raise WpkgConfigError("The password type %s is invalid, provide either 'clear:password' or 'crypt:encryptedpassword'" % self.passwordtype)
+        else:
+            return None
+    def set(self, new_value):
+        encrypted_password = win32crypt.CryptProtectData(new_value, "Password", None, None, None, 0)
+        base64_password = base64.b64encode(encrypted_password)
+        # Add hash at end to force qouting by configobj module
+        value = 'crypt:%s#' % base64_password
+        self.caller.write_ini(self.name, value)
+
+class WpkgEnvironmentVariables(object):
+    def __init__(self, caller):
+        self.caller = caller
+    def get(self):
+        environment = self.caller.snapshot.environment
+        if environment == None:
+            logger.debug("EnvironmentVariables section not configured in ini file")
+            return None
+        logger.debug("Reading EnvironmentVariables from ini file")
+        for k, v in environment.items():
+            logger.debug("EnvrionmentVariable %s is '%s'" % (k, v))
+        return dict(environment)
+
+
+def main():
+    config = WpkgConfig()
+    print config.EnvironmentVariables.get()
+        
+    for setting in config.settings:
+        print "%s is %s" % (setting.name, setting.get())
+
+if __name__=='__main__':
+    import sys
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")                        
+    h = logging.StreamHandler(sys.stdout)
+    h.setFormatter(formatter)
+    logger = logging.getLogger("WpkgConfig")
+    logger.addHandler(h)
+    logger.setLevel(logging.DEBUG)
+    main()
+else:
+    h = NullHandler()
+    logger = logging.getLogger("WpkgService")
+    logger.addHandler(h)
@@ -0,0 +1,498 @@
+"""WpkgEngine.py
+Evaluates hosts.xml, profiles.xml, packages.xml and the local wpkg.xml
+the way wpkg.js /query does, without starting cscript.
+
+Only the parts of wpkg.js needed for a query are implemented. Whenever
+the engine meets something it does not know how to evaluate (host
+attributes other than name, several matching host entries, <condition>
+elements, execute checks, unknown check conditions, ...) it raises
+WpkgEngineUnsupported and native_query() falls back to running wpkg.js.
+
+Conformance with wpkg.js can be verified with recorded query output:
+
+    WpkgEngine.py conform <dir> [<dir> ...]
+
+Every directory holds copies of hosts.xml, profiles.xml and packages.xml
+(or the hosts, profiles and packages directories), the local wpkg.xml,
+a file "host" containing the host name, and "query.txt" with the output
+of cscript wpkg.js /query:Iudr for that host. Instead of query.txt, a
+query log saved in logs\\runs can be copied as "query.log.gz". Optionally
+"checks.txt" lists the result of the package checks on the recorded
+machine, one "package-id true|false" per line, and "environment.txt" the
+EnvironmentVariables of the ini file, one "name=value" per line. A
+directory with a file "fallback" has to make native_query() fall back to
+wpkg.js instead. The directories in conformance\\ are checked with every change of
+the engine:
+
+    WpkgEngine.py conform conformance\\*
+"""
+import os
+import re
+import logging
+import xml.etree.ElementTree as ElementTree
+
+import WpkgFingerprint
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+class WpkgEngineUnsupported(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+
+def localname(tag):
+    # Removes the namespace from an element tag
+    return tag.rsplit("}", 1)[-1]
+
+
+def children(element, name):
+    return [e for e in element if localname(e.tag) == name]
+
+
+def reject_conditions(element, what):
+    # wpkg.js evaluates <condition> elements on the machine, the engine
+    # does not
+    for e in element.iter():
+        if localname(e.tag) == "condition":
+            raise WpkgEngineUnsupported("<condition> in %s" % what)
+
+
+def compare_versions(a, b):
+    # Compares revisions like wpkg.js: part by part, numerically where both
+    # parts are numbers. Returns -1, 0 or 1.
+    parts_a = re.split(r"[.\-]", a.strip())
+    parts_b = re.split(r"[.\-]", b.strip())
+    for i in range(max(len(parts_a), len(parts_b))):
+        part_a = i < len(parts_a) and parts_a[i] or "0"
+        part_b = i < len(parts_b) and parts_b[i] or "0"
+        if part_a.isdigit() and part_b.isdigit():
+            result = cmp(int(part_a), int(part_b))
+        else:
+            result = cmp(part_a, part_b)
+        if result != 0:
+            return result
+    return 0
+
+
+class WpkgPackage(object):
+    def __init__(self, element, environment=None):
+        self.element = element
+        # Upper case names, as on Windows
+        if environment == None:
+            environment = dict((k.upper(), v) for k, v in os.environ.items())
+        self.environment = environment
+        self.id = element.get("id")
+        self.name = element.get("name", self.id)
+        self.raw_revision = element.get("revision", "0")
+        self.priority = int(element.get("priority", "0") or 0)
+        self.execute = element.get("execute", "once")
+        self.variables = dict((v.get("name"), v.get("value", "")) for v in children(element, "variable"))
+        self.checks = children(element, "check")
+        self.depends = [d.get("package-id") for d in children(element, "depends")]
+        self.chain = [d.get("package-id") for d in children(element, "chain")]
+
+    def expand(self, value, variables):
+        # Expands %name% with package variables, then profile and host
+        # variables, then the environment wpkg.js is started with
+        def lookup(match):
+            name = match.group(1)
+            for scope in (self.variables, variables):
+                for k, v in scope.items():
+                    if k.lower() == name.lower():
+                        return v
+            return self.environment.get(name.upper(), match.group(0))
+        for i in range(5): # Variables may refer to other variables
+            expanded = re.sub(r"%([^%]+)%", lookup, value)
+            if expanded == value:
+                break
+            value = expanded
+        return value
+
+
+class WpkgCheckEvaluator(object):
+    # Evaluates package checks on this machine
+    uninstall_keys = (R"SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall",
+                      R"SOFTWARE\Wow6432Node\Microsoft\Windows\CurrentVersion\Uninstall")
+
+    def __init__(self):
+        self.uninstall = None
+
+    def evaluate_package(self, package, variables):
+        for check in package.checks:
+            if not self.evaluate(package, check, variables):
+                return False
+        return True
+
+    def evaluate(self, package, check, variables):
+        check_type = check.get("type", "").lower()
+        condition = check.get("condition", "").lower()
+        path = package.expand(check.get("path", ""), variables)
+        value = package.expand(check.get("value", ""), variables)
+        if check_type == "logical":
+            results = [self.evaluate(package, c, variables) for c in children(check, "check")]
+            if condition == "and":
+                return all(results)
+            elif condition == "or":
+                return any(results)
+            elif condition == "not":
+                return not any(results)
+            elif condition == "atleast":
+                return results.count(True) >= int(value)
+            elif condition == "atmost":
+                return results.count(True) <= int(value)
+        elif check_type == "registry":
+            data = self.read_registry(path)
+            if condition == "exists":
+                return data != None
+            elif condition == "equals":
+                return data != None and unicode(data) == value
+        elif check_type == "file":
+            if condition == "exists":
+                return os.path.exists(path)
+            elif condition == "sizeequals":
+                return os.path.isfile(path) and os.path.getsize(path) == int(value)
+            elif condition.startswith("version"):
+                return self.compare(self.file_version(path), condition, value)
+        elif check_type == "uninstall":
+            versions = self.uninstall_entries().get(path.lower())
+            if condition == "exists":
+                return versions != None
+            elif condition.startswith("version"):
+                if versions == None:
+                    return False
+                return any([self.compare(v, condition, value) for v in versions])
+        raise WpkgEngineUnsupported("check type '%s' condition '%s'" % (check_type, condition))
+
+    def compare(self, version, condition, value):
+        if version == None:
+            return False
+        result = compare_versions(version, value)
+        conditions = {"versionsmallerthan": result < 0,
+                      "versionlessorequal": result <= 0,
+                      "versionequalto": result == 0,
+                      "versiongreaterorequal": result >= 0,
+                      "versiongreaterthan": result > 0}
+        try:
+            return conditions[condition]
+        except KeyError:
+            raise WpkgEngineUnsupported("check condition '%s'" % condition)
+
+    def read_registry(self, path):
+        import _winreg
+        hives = {"HKLM": _winreg.HKEY_LOCAL_MACHINE, "HKEY_LOCAL_MACHINE": _winreg.HKEY_LOCAL_MACHINE,
+                 "HKCU": _winreg.HKEY_CURRENT_USER, "HKEY_CURRENT_USER": _winreg.HKEY_CURRENT_USER,
+                 "HKCR": _winreg.HKEY_CLASSES_ROOT, "HKEY_CLASSES_ROOT": _winreg.HKEY_CLASSES_ROOT,
+                 "HKU": _winreg.HKEY_USERS, "HKEY_USERS": _winreg.HKEY_USERS}
+        hive, _, rest = path.partition("\\")
+        if hive.upper() not in hives:
+            raise WpkgEngineUnsupported("registry hive '%s'" % hive)
+        hive = hives[hive.upper()]
+        if rest.endswith("\\"): # A key
+            try:
+                _winreg.CloseKey(_winreg.OpenKey(hive, rest.rstrip("\\"), 0, _winreg.KEY_READ | _winreg.KEY_WOW64_64KEY))
+                return ""
+            except WindowsError:
+                return None
+        key, _, name = rest.rpartition("\\")
+        try:
+            with _winreg.OpenKey(hive, key, 0, _winreg.KEY_READ | _winreg.KEY_WOW64_64KEY) as k:
+                return _winreg.QueryValueEx(k, name)[0]
+        except WindowsError:
+            pass
+        try: # wpkg.js also accepts a key without trailing backslash
+            _winreg.CloseKey(_winreg.OpenKey(hive, rest, 0, _winreg.KEY_READ | _winreg.KEY_WOW64_64KEY))
+            return ""
+        except WindowsError:
+            return None
+
+    def file_version(self, path):
+        import win32api
+        try:
+            info = win32api.GetFileVersionInfo(path, "\\")
+        except win32api.error:
+            return None
+        ms, ls = info["FileVersionMS"], info["FileVersionLS"]
+        return "%i.%i.%i.%i" % (ms >> 16, ms & 0xffff, ls >> 16, ls & 0xffff)
+
+    def uninstall_entries(self):
+        # DisplayName -> list of DisplayVersion, read once per evaluation
+        if self.uninstall != None:
+            return self.uninstall
+        import _winreg
+        self.uninstall = {}
+        for path in self.uninstall_keys:
+            try:
+                root = _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, path, 0, _winreg.KEY_READ | _winreg.KEY_WOW64_64KEY)
+            except WindowsError:
+                continue
+            i = 0
+            while 1:
+                try:
+                    subkey = _winreg.EnumKey(root, i)
+                except WindowsError:
+                    break
+                i = i + 1
+                try:
+                    with _winreg.OpenKey(root, subkey) as k:
+                        name = _winreg.QueryValueEx(k, "DisplayName")[0]
+                        try:
+                            version = _winreg.QueryValueEx(k, "DisplayVersion")[0]
+                        except WindowsError:
+                            version = None
+                except WindowsError:
+                    continue
+                self.uninstall.setdefault(name.lower(), []).append(version)
+            _winreg.CloseKey(root)
+        return self.uninstall
+
+
+class WpkgRecordedChecks(object):
+    # Check results recorded on another machine, used by the conformance suite
+    def __init__(self, results):
+        self.results = results
+
+    def evaluate_package(self, package, variables):
+        try:
+            return self.results[package.id]
+        except KeyError:
+            raise WpkgEngineUnsupported("no recorded check result for '%s'" % package.id)
+
+
+class WpkgEngine(object):
+    def __init__(self, wpkg_path, local_xml=None, checks=None, environment=None):
+        # environment holds the variables set for wpkg.js in addition to the
+        # ones of the service, e.g. EnvironmentVariables of the ini file
+        self.wpkg_path = wpkg_path
+        self.environment = dict((k.upper(), v) for k, v in os.environ.items())
+        if environment != None:
+            self.environment.update(dict((k.upper(), v) for k, v in environment.items()))
+        if local_xml == None:
+            local_xml = WpkgFingerprint.get_local_wpkg_xml()
+        self.local_xml = local_xml
+        if checks == None:
+            checks = WpkgCheckEvaluator()
+        self.checks = checks
+
+    def load(self, name):
+        # Returns all elements of the given kind from name.xml or the files
+        # in the directory name
+        files = []
+        path = os.path.join(self.wpkg_path, name + ".xml")
+        if os.path.isfile(path):
+            files.append(path)
+        directory = os.path.join(self.wpkg_path, name)
+        if os.path.isdir(directory):
+            files.extend([os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.lower().endswith(".xml")])
+        elements = []
+        for f in files:
+            root = ElementTree.parse(f).getroot()
+            elements.extend(children(root, name[:-1]))
+        return elements
+
+    def find_host(self, hostname, hosts):
+        # Returns the only host entry matching hostname. wpkg.js applies
+        # every matching entry and matches on more than the name, neither
+        # is evaluated here.
+        hostname = hostname.lower()
+        matches = []
+        for host in hosts:
+            unsupported = [a for a in host.keys() if a not in ("name", "profile-id")]
+            if unsupported:
+                raise WpkgEngineUnsupported("host attributes %s" % ", ".join(unsupported))
+            name = host.get("name", "")
+            if name.lower() == hostname:
+                matches.append(host)
+                continue
+            try:
+                if re.match("^(?:%s)$" % name, hostname, re.IGNORECASE):
+                    matches.append(host)
+            except re.error:
+                continue
+        if len(matches) > 1:
+            raise WpkgEngineUnsupported("%i host entries match '%s'" % (len(matches), hostname))
+        if matches:
+            return matches[0]
+        return None
+
+    def query(self, hostname):
+        # Returns a list of (task, name, revision) like WpkgQueryParser
+        hosts = self.load("hosts")
+        host = self.find_host(hostname, hosts)
+        if host == None:
+            raise WpkgEngineUnsupported("no host entry matches '%s'" % hostname)
+        reject_conditions(host, "host '%s'" % host.get("name"))
+        variables = dict((v.get("name"), v.get("value", "")) for v in children(host, "variable"))
+
+        # Profiles, including the ones they depend on
+        profiles = dict((p.get("id"), p) for p in self.load("profiles"))
+        profile_ids = []
+        if host.get("profile-id"):
+            profile_ids.append(host.get("profile-id"))
+        profile_ids.extend([p.get("id") for p in children(host, "profile")])
+        seen = set()
+        while profile_ids:
+            profile_id = profile_ids.pop(0)
+            if profile_id in seen:
+                continue
+            seen.add(profile_id)
+            try:
+                profile = profiles[profile_id]
+            except KeyError:
+                raise WpkgEngineUnsupported("unknown profile '%s'" % profile_id)
+            reject_conditions(profile, "profile '%s'" % profile_id)
+            for v in children(profile, "variable"):
+                variables.setdefault(v.get("name"), v.get("value", ""))
+            profile_ids.extend([d.get("profile-id") for d in children(profile, "depends")])
+
+        # Packages of the profiles, including dependencies and chained packages
+        packages = dict((p.get("id"), WpkgPackage(p, self.environment)) for p in self.load("packages"))
+        wanted = []
+        for profile_id in seen:
+            wanted.extend([p.get("package-id") for p in children(profiles[profile_id], "package")])
+        desired = {}
+        while wanted:
+            package_id = wanted.pop(0)
+            if package_id in desired:
+                continue
+            try:
+                package = packages[package_id]
+            except KeyError:
+                raise WpkgEngineUnsupported("unknown package '%s'" % package_id)
+            if package.execute != "once":
+                raise WpkgEngineUnsupported("package '%s' has execute='%s'" % (package_id, package.execute))
+            reject_conditions(package.element, "package '%s'" % package_id)
+            desired[package_id] = package
+            wanted.extend(package.depends)
+            wanted.extend(package.chain)
+
+        installed = {}
+        if os.path.isfile(self.local_xml):
+            for p in children(ElementTree.parse(self.local_xml).getroot(), "package"):
+                installed[p.get("id")] = p
+
+        records = []
+        for package_id, package in sorted(desired.items(), key=lambda i: (-i[1].priority, i[0])):
+            name = package.name.encode("utf-8")
+            revision = package.expand(package.raw_revision, variables)
+            if package_id in installed:
+                result = compare_versions(revision, installed[package_id].get("revision", "0"))
+                if result > 0:
+                    records.append(("update", name, revision))
+                elif result < 0:
+                    records.append(("downgrade", name, revision))
+                elif package.checks and not self.checks.evaluate_package(package, variables):
+                    # Listed in wpkg.xml but removed or broken since,
+                    # wpkg.js installs it again
+                    records.append(("install", name, revision))
+            elif not self.is_installed(package, variables):
+                records.append(("install", name, revision))
+        for package_id, element in sorted(installed.items()):
+            if package_id not in desired:
+                records.append(("remove", element.get("name", package_id).encode("utf-8"), element.get("revision", "0")))
+        return records
+
+    def is_installed(self, package, variables):
+        # A package not listed in wpkg.xml is installed if it has checks and
+        # all of them succeed
+        if not package.checks:
+            return False
+        return self.checks.evaluate_package(package, variables)
+
+
+def native_query(wpkg_path, hostname, environment=None, local_xml=None, checks=None):
+    # Returns the query result computed without wpkg.js, or None if wpkg.js
+    # has to be used
+    engine = WpkgEngine(wpkg_path, local_xml, checks, environment)
+    try:
+        records = engine.query(hostname)
+        logger.info(R"Query answered by the native engine")
+        return records
+    except WpkgEngineUnsupported, e:
+        logger.info(R"The native engine can not evaluate this host (%s), using wpkg.js" % e)
+    except Exception:
+        logger.exception(R"The native engine failed, using wpkg.js:")
+    return None
+
+
+def read_lines(path):
+    # The non empty lines of path that are no comment
+    if not os.path.isfile(path):
+        return []
+    return [line.strip() for line in open(path) if line.strip() and not line.startswith("#")]
+
+
+def conform(directory):
+    # Compares the engine with the output of wpkg.js recorded in directory
+    import gzip
+    import WpkgOutputParser
+    hostname = open(os.path.join(directory, "host")).read().strip()
+    results = {}
+    for line in read_lines(os.path.join(directory, "checks.txt")):
+        package_id, result = line.split()
+        results[package_id] = result.lower() == "true"
+    environment = dict([line.split("=", 1) for line in read_lines(os.path.join(directory, "environment.txt"))])
+    checks = WpkgRecordedChecks(results)
+    local_xml = os.path.join(directory, "wpkg.xml")
+    if os.path.isfile(os.path.join(directory, "fallback")):
+        # The same call Query uses
+        if native_query(directory, hostname, environment, local_xml, checks) == None:
+            print "PASS %s (falls back to wpkg.js)" % directory
+            return True
+        print "FAIL %s: answered by the engine, but must fall back to wpkg.js" % directory
+        return False
+    engine = WpkgEngine(directory, local_xml, checks, environment)
+    parser = WpkgOutputParser.WpkgQueryParser("cp850")
+    if os.path.isfile(os.path.join(directory, "query.txt")):
+        recorded = open(os.path.join(directory, "query.txt"))
+    else:
+        recorded = gzip.open(os.path.join(directory, "query.log.gz"))
+    expected = []
+    for line in recorded:
+        record = parser.parse_line(line)
+        if record != None:
+            expected.append(record)
+    recorded.close()
+    try:
+        actual = engine.query(hostname)
+    except WpkgEngineUnsupported, e:
+        print "SKIP %s: unsupported %s" % (directory, e)
+        return True
+    def normalize(records):
+        # The query parser removes double spaces
+        return sorted([(task, re.sub(r"\s{2,}", "", name.strip()), revision.strip())
+                       for task, name, revision in records])
+    missing = [r for r in normalize(expected) if r not in normalize(actual)]
+    extra = [r for r in normalize(actual) if r not in normalize(expected)]
+    if not missing and not extra:
+        print "PASS %s (%i packages)" % (directory, len(expected))
+        return True
+    print "FAIL %s" % directory
+    for r in missing:
+        print "  only in wpkg.js: %s %s %s" % r
+    for r in extra:
+        print "  only in engine.: %s %s %s" % r
+    return False
+
+
+h = NullHandler()
+logger = logging.getLogger("WpkgService")
+logger.addHandler(h)
+
+if __name__=='__main__':
+    import sys
+    if len(sys.argv) > 2 and sys.argv[1] == "conform":
+        failed = [d for d in sys.argv[2:] if not conform(d)]
+        print "%i of %i passed" % (len(sys.argv) - 2 - len(failed), len(sys.argv) - 2)
+        sys.exit(len(failed) > 0)
+    elif len(sys.argv) > 2 and sys.argv[1] == "query":
+        engine = WpkgEngine(sys.argv[2])
+        for record in engine.query(os.getenv("computername")):
+            print "TASK: %s\tNAME: %s\tREVISION: %s" % record
+    else:
+        print "Usage: %s conform <dir> [<dir> ...] | query <wpkg path>" % os.path.split(sys.argv[0])[1]
@@ -0,0 +1,207 @@
+"""WpkgEstimator.py
+Estimates how long a run still takes from the durations of earlier runs
+
+The time every package took to verify, install, upgrade or remove is read
+from the run history of this computer. A seed file, e.g. collected from
+the histories of other computers, supplies durations for packages that
+have never run here. Every line of the seed file is
+
+    package<TAB>phase<TAB>average seconds<TAB>number of runs
+
+and it can be written from a history with "WpkgEstimator.py export".
+"""
+import time
+import logging
+
+# Seconds used when nothing is known about a phase
+DEFAULT_DURATIONS = {"verifying": 1.0, "removing": 1.0, "installing": 60.0, "upgrading": 60.0}
+# Query tasks -> phase of wpkg.js performing them
+TASK_PHASES = {"install": "installing", "update": "upgrading", "downgrade": "upgrading", "remove": "removing"}
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+def average_durations(connection, days=90):
+    # [(package, phase, average seconds, runs), ...] of the runs on this computer
+    return connection.execute(
+        "SELECT package, phase, AVG(finished - started), COUNT(*) FROM operations "
+        "WHERE started >= ? GROUP BY package, phase", (time.time() - days * 86400,)).fetchall()
+
+
+def last_order(connection):
+    # The packages in the order the last execution verified them
+    row = connection.execute(
+        "SELECT id FROM runs WHERE kind = 'execute' AND exitcode = 0 ORDER BY started DESC LIMIT 1").fetchone()
+    if row == None:
+        return []
+    return [package for (package,) in connection.execute(
+        "SELECT package FROM operations WHERE run_id = ? AND phase = 'verifying' ORDER BY started", row)]
+
+
+def read_seed(path):
+    # {(package, phase): (average seconds, runs)}, duplicates are merged
+    durations = {}
+    try:
+        with open(path, "r") as seed_file:
+            for line in seed_file:
+                fields = line.rstrip("\r\n").split("\t")
+                if len(fields) < 3 or line.startswith("#"):
+                    continue
+                try:
+                    seconds = float(fields[2])
+                    runs = len(fields) > 3 and int(fields[3]) or 1
+                except ValueError:
+                    continue
+                key = (fields[0], fields[1])
+                if key in durations:
+                    known, known_runs = durations[key]
+                    seconds = (known * known_runs + seconds * runs) / (known_runs + runs)
+                    runs = known_runs + runs
+                durations[key] = (seconds, runs)
+    except IOError, e:
+        logger.info("Unable to read the duration seed file %s: %s" % (path, e))
+    return durations
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return _("less than a minute")
+    minutes = int(seconds / 60 + 0.5)
+    if minutes == 1:
+        return _("about a minute")
+    if minutes < 120:
+        return _("about %i minutes") % minutes
+    return _("about %i hours") % int(minutes / 60 + 0.5)
+
+
+class WpkgEstimator(object):
+    def __init__(self, history=None, seed_file=None, days=90):
+        self.history = history
+        self.seed_file = seed_file
+        self.days = days
+        self.durations = {} # (package, phase) -> seconds, package in utf-8
+        self.defaults = dict(DEFAULT_DURATIONS)
+        self.order = []
+        self.pending = {} # package -> phase, from the last query
+        self.start()
+
+    def load(self):
+        # Reads the durations again, called before every run
+        durations = {}
+        if self.seed_file:
+            for key, (seconds, runs) in read_seed(self.seed_file).items():
+                durations[key] = seconds
+        order = []
+        if self.history != None:
+            # Durations measured on this computer replace the seeded ones
+            for package, phase, seconds, runs in self.history.read(average_durations, self.days) or []:
+                durations[(package.encode("utf-8"), phase)] = seconds
+            order = [package.encode("utf-8") for package in self.history.read(last_order) or []]
+        self.durations = durations
+        self.order = order
+        # Unknown packages take as long as the median package of the phase
+        self.defaults = dict(DEFAULT_DURATIONS)
+        for phase in self.defaults:
+            known = sorted([seconds for (package, p), seconds in durations.items() if p == phase])
+            if known:
+                self.defaults[phase] = known[len(known) / 2]
+
+    def known(self):
+        return bool(self.durations)
+
+    def duration(self, package, phase):
+        try:
+            return self.durations[(package, phase)]
+        except KeyError:
+            return self.defaults.get(phase, 0)
+
+    def task_duration(self, task, package):
+        # Expected seconds for one task of a query result, None if unknown
+        return self.durations.get((package, TASK_PHASES.get(task)))
+
+    def set_pending(self, records):
+        # The result of the last query, the tasks the next execution performs
+        self.pending = dict([(name, TASK_PHASES.get(task)) for task, name, revision in records])
+
+    def start(self):
+        # Called when wpkg.js is started
+        self.started = time.time()
+        self.event = None
+        self.event_started = self.started
+        self.done = set()
+
+    def update(self, event):
+        # Called with every WpkgStatusEvent of the run
+        if self.event != None and (event.package, event.phase) == (self.event.package, self.event.phase):
+            return
+        if self.event != None:
+            self.done.add(self.event.package)
+        self.event = event
+        self.event_started = time.time()
+
+    def remaining(self, now=None):
+        # Expected seconds until wpkg.js has finished
+        if now == None:
+            now = time.time()
+        event = self.event
+        if event == None:
+            return sum([self.duration(package, "verifying") for package in self.order]) + \
+                   sum([self.duration(package, phase) for package, phase in self.pending.items()])
+        # The rest of the current operation, at least a little when it takes
+        # longer than ever before
+        current = self.duration(event.package, event.phase)
+        seconds = max(current - (now - self.event_started), current * 0.1)
+        if event.phase == "removing":
+            # The packages to install are verified after all removals
+            seconds = seconds + (event.total - event.index) * self.defaults["removing"]
+            verify = self.order or []
+        elif len(self.order) == event.total and event.index <= len(self.order):
+            verify = self.order[event.index:]
+        else:
+            verify = [None] * max(event.total - event.index, 0)
+        seconds = seconds + sum([self.duration(package, "verifying") for package in verify])
+        # Pending tasks that have not been started yet
+        for package, phase in self.pending.items():
+            if package not in self.done and package != event.package:
+                seconds = seconds + self.duration(package, phase)
+        return seconds
+
+    def estimate(self, now=None):
+        # (remaining seconds, percent done), or None if no run has been
+        # measured yet
+        if not self.known():
+            return None
+        if now == None:
+            now = time.time()
+        remaining = self.remaining(now)
+        elapsed = now - self.started
+        if elapsed + remaining <= 0:
+            return remaining, 0
+        return remaining, int(100 * elapsed / (elapsed + remaining))
+
+    def get_formatted_estimate(self):
+        estimate = self.estimate()
+        if estimate == None:
+            return ""
+        remaining, percent = estimate
+        # Example: , 40% done, about 5 minutes left
+        return ", " + _("%i%% done, %s left") % (percent, format_duration(remaining))
+
+h = NullHandler()
+logger = logging.getLogger("WpkgService")
+logger.addHandler(h)
+
+if __name__=='__main__':
+    import sys
+    import WpkgHistory
+    if len(sys.argv) < 3 or sys.argv[1] != "export":
+        print "Usage: %s export history.db [days] > seed.txt" % sys.argv[0]
+        sys.exit(1)
+    history = WpkgHistory.WpkgHistory(sys.argv[2], 0)
+    days = len(sys.argv) > 3 and int(sys.argv[3]) or 90
+    for package, phase, seconds, runs in history.read(average_durations, days) or []:
+        print "%s\t%s\t%.1f\t%i" % (package.encode("utf-8"), phase, seconds, runs)
+    history.close()
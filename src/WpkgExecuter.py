@@ -1,366 +1,696 @@
-# -*- coding: utf-8 -*-
-"""WPKGExecuter.py
-Class for executing WPKG
-"""
-import WpkgConfig
-import WpkgWriter
-import WpkgNetworkHandler
-import WpkgOutputParser
-import WpkgRebootHandler
-import logging
-import sys, os, re, subprocess, time
-
-try:
-    from Queue import Queue, Empty
-except ImportError:
-    from queue import Queue, Empty  # python 3.x
-from threading import Thread
-
-
-def enqueue_output(out, queue):
-    for line in iter(out.readline, ''):
-        queue.put(line)
-    out.close()
-
-
-class NullHandler(logging.Handler):
-    def emit(self, record):
-        pass
-
-
-class WpkgExecuter():
-    
-    is_running = False
-    
-    def __init__(self, handle=None):
-        self.config = WpkgConfig.WpkgConfig()
-        self.wpkg_command = self.config.get("WpkgCommand")
-        self.codepage = self.config.get_codepage()
-        self.writer = WpkgWriter.WpkgWriter(handle)
-        self.network_handler = WpkgNetworkHandler.WpkgNetworkHandler()
-        self.parser = WpkgOutputParser.WpkgOutputParser(self.codepage)
-        self.reboot_handler = WpkgRebootHandler.WpkgRebootHandler()
-        self.parse_wpkg_command()
-
-        self.activityvalue = 0
-    
-    def parse_wpkg_command(self):
-        commandstring = self.wpkg_command
-        commandstring = os.path.expandvars(commandstring) #Expanding variables
-
-        # check if starts with cscript and contains /noreboot /synchronize
-        # and/or /sendStatus is in command. If not, add it.
-        
-        # split command line by space except when quoted - preserve quotes
-        commandlist = re.findall(r'(?:[^\s"]|"(?:\\.|[^"])*")+', commandstring)
-        is_js_script = False
-        
-        # remove possible quotes before checking whether it is a js script
-        jscommand = re.sub(r'^"|"$', '', commandlist[0]).lower()
-
-        if jscommand == "cscript" or jscommand[-3:]==".js":
-           is_js_script = True
-        if is_js_script == True:
-            if commandlist[0].lower() != "cscript":
-                logger.debug("WpkgCommand is a js file but is missing 'cscript', adding")
-                commandlist.insert(0, "cscript")
-            if not "/noreboot" in commandlist:
-                logger.debug("WpkgCommand is a js but is missing /noreboot, adding")
-                commandlist.append("/noreboot")
-            if not "/synchronize" in commandlist:
-                logger.debug("WpkgCommand is a js but is missing /synchronize, adding")
-                commandlist.append("/synchronize")
-            if not "/sendStatus" in commandlist:
-                logger.debug("WpkgCommand is a js but is missing /sendStatus, adding")
-                commandlist.append("/sendStatus")
-            if not "/nonotify" in commandlist:
-                logger.debug("WpkgCommand is a js but is missing /nonotify, adding")
-                commandlist.append("/nonotify")
-            if not "/quiet" in commandlist:
-                logger.debug("WpkgCommand is a js but is missing /quiet, adding")
-                commandlist.append("/quiet")
-        self.execute_command = " ".join(commandlist)
-
-    def Query(self, handle=None):
-        self.writer = WpkgWriter.WpkgWriter(handle)
-
-        # Adding query and dryrun parameter to execute command
-        # /dryrun is used to the file date of wpkg.xml is untouched
-        self.query_command = self.execute_command + ' /query:Iudr'
-        if self.is_running:
-            logger.info(R"Client requested WPKG to execute query, but WPKG is already running.")
-            msg = "201 " + _("Info: WPKG is already running a task.")
-            self.writer.Write(msg)
-            return
-
-        parsedline = _("Initializing Wpkg-GP software query")
-        self.writer.Write("100 " + parsedline)
-        logger.info(R"Executing WPKG with the command %s" % self.execute_command)
-
-        # Open the network share as another user, if necessary
-        if not self.network_handler.connect_to_network_share():
-            net_msg = _("Error: Connecting to network share failed.")
-            self.writer.Write("204 " + net_msg)
-            logger.error("Connecting to network share failed. Exiting.")
-            return
-
-        # Check if System is on Blacklist
-        if not self.allowed_to_execute():
-            net_msg = _("Info: Client was blocked from server to execute wpkg.")
-            self.writer.Write("205 " + net_msg)
-            logger.info("Client was blocked from server to execute wpkg.")
-            return
-
-        # Add environment parameters
-        env = os.environ.copy()
-        config_env = self.config.EnvironmentVariables.get()
-        if config_env != None:
-            env.update(config_env)
-        # logger.debug(R"Environment variables are: %s" % env)
-
-        # Set wpkg runningstate true
-        self.config.set_wpkg_runningstate('true')
-
-        # Run WPKG Query
-        self.proc = subprocess.Popen(self.query_command, stdout=subprocess.PIPE, bufsize=1, universal_newlines=True,
-                                     env=env)
-        self.isrunning = True
-
-        output = self.proc.communicate()
-        lines = output[0].split('\n')
-        exitcode = self.proc.poll()
-        self.is_running = False
-
-        logger.info(R"Finished executing Wpkg.js Query")
-
-        if exitcode == 1:  # Cscript returned an error
-            logger.error(R"WPKG command returned an error: %s" % lines[-1:])
-            self.writer.Write("200 " + _("Wpkg returned an error: %s") % lines[-1][0:-1])
-            return
-
-        value_dict = {'Installation pending':'install',
-                      'Upgrade pending':'update',
-                      'Downgrade pending': 'downgrade',
-                      'Remove pending': 'remove'}
-        excludes = ('ID:', 'Reboot:', 'Execute:', 'Priority:', 'Status:', 'Revision (old):')
-
-        # Remove the 4 leading lines
-        [lines.pop(0) for n in [0, 1, 2, 3]]
-        cleaned_lines = []
-
-        # filter output more for relevant information
-        for line in lines:
-            # Remove Leading Spaces
-            line = line.lstrip()
-            # Remove double spaces
-            line = re.sub('\s{2,}', '', line)
-            if line != '':
-                # If line not empty add data to the cleaned_lines list
-                if line.startswith(excludes):
-                    # exclude data we don't want
-                    continue
-                elif line.startswith('Revision:'):
-                    value = line.replace('Revision:', '')
-                elif line.startswith('Revision (new):'):
-                    value = line.replace('Revision (new):', '')
-                elif line.startswith('Action:'):
-                    value = line.replace('Action:', '')
-                    value = value_dict[value]
-                else:
-                    # Package Name
-                    value = line.decode(self.codepage).encode('utf-8')
-                cleaned_lines.append(value)
-
-        # Closing handle to share
-        self.network_handler.disconnect_from_network_share()
-
-        # convert list into list with sublists (every 3 entries become a sublist)
-        composite_list = [cleaned_lines[x:x + 3] for x in range(0, len(cleaned_lines), 3)]
-        # TODO: Add Sorting to composite_list?
-
-        if composite_list:
-            for name, version, task in composite_list:
-                # Write Info to pipe
-                query_msg = "103 TASK: %s\tNAME: %s\tREVISION: %s" % (task, name, version)
-                self.writer.Write(query_msg)
-        else:
-            query_msg = "104 " + _("No pending wpkg tasks")
-            self.writer.Write(query_msg)
-
-    def Execute(self, handle=None, rebootcancel=False):
-        self.writer = WpkgWriter.WpkgWriter(handle)
-        lines = []
-        if self.is_running:
-            logger.info(R"Client requested WPKG to execute, but WPKG is already running.")
-            msg = "201 " + _("Info: WPKG is already running a task.")
-            self.writer.Write(msg)
-            return
-
-        parsedline = _("Initializing Wpkg-GP software installation")
-        self.writer.Write("100 " + parsedline)
-        logger.info(R"Executing WPKG with the command %s" % self.execute_command)
-
-        #Open the network share as another user, if necessary
-        if not self.network_handler.connect_to_network_share():
-            net_msg = _("Error: Connecting to network share failed.")
-            self.writer.Write("204 " + net_msg)
-            logger.error("Connecting to network share failed. Exiting.")
-            if not rebootcancel:
-                time.sleep(2)
-            return
-
-        # Check if System is on Blacklist
-        if not self.allowed_to_execute():
-            net_msg = _("Info: Client was blocked from server to execute wpkg.")
-            self.writer.Write("205 " + net_msg)
-            logger.info("Client was blocked from server to execute wpkg.")
-            if not rebootcancel:
-                # Enough time to see the message during bootup
-                time.sleep(4)
-            return
-
-        # Add environment parameters
-        env = os.environ.copy()
-        config_env = self.config.EnvironmentVariables.get()
-        if config_env != None:
-            env.update(config_env)
-        #logger.debug(R"Environment variables are: %s" % env)
-
-        # Set wpkg runningstate true
-        self.config.set_wpkg_runningstate('true')
-
-        # Run WPKG
-        self.proc = subprocess.Popen(self.execute_command, stdout=subprocess.PIPE, bufsize=1, universal_newlines=True, env=env)
-        self.isrunning = True
-
-        q = Queue()
-        t = Thread(target=enqueue_output, args=(self.proc.stdout, q))
-        t.daemon = True
-        t.start()
-
-        if self.config.get("WpkgActivityIndicator") == 1:
-            show_activity = True
-        else:
-            show_activity = False
-
-        #Reading lines
-        quit = False
-        lastsec = None
-        while 1:
-            try:
-                line = q.get(timeout=0.05)
-            except Empty:
-                if quit:
-                    break # Now we have appended the last line
-                if show_activity:
-                    currsec = time.time()
-                    if(lastsec != None and currsec - lastsec >= 1): #Show every 1 sec
-                        self.writer.Write("101 %s%s" % (parsedline, self.GetActivityIndicator()))
-                        lastsec = currsec
-            else:
-                lines.append(line)
-                if quit:
-                    break # Now we have appended the last line
-                self.parser.parse_line(line)
-                if self.parser.updated:
-                    parsedline = self.parser.get_formatted_line()
-                    self.writer.Write("100 %s      " % parsedline)
-                    lastsec = time.time() # Reset timer
-            if self.proc.poll() != None: #Wpkg is finished
-                self.is_running = False
-                quit = True # Run a last loop to fetch the last line
-            
-        self.parser.reset()
-        
-        exitcode = self.proc.poll()
-        #Closing handle to share
-        self.network_handler.disconnect_from_network_share()
-        logger.info(R"Finished executing Wpkg.js")
-            
-        if exitcode == 1: #Cscript returned an error
-            logger.error(R"WPKG command returned an error: %s" % lines[-1:])
-            self.writer.Write("200 " + _("Wpkg returned an error: %s") % lines[-1][0:-1])
-            return
-        
-        if exitcode == 770560: #WPKG returns this when it requests a reboot
-            logger.info(R"WPKG requested a reboot")
-            status = self.reboot_handler.reboot(rebootcancel)
-            self.writer.Write(status)
-        else:
-            self.reboot_handler.reset_reboot_number()
-
-        self.config.set_wpkg_synctime()
-
-    def Cancel(self, handle=sys.stdout):
-        if self.isrunning:
-            self.proc.kill()
-            logger.info("Cancel called, WPKG process was killed.")
-            msg = "105 " + _("Cancel called, WPKG process was killed")
-        else:
-            logger.info("Cancel called, but WPKG process was not running")
-            msg = "202 " + _("Cancel called, WPKG process was not running")
-        try:
-            self.writer.Write(handle, msg)
-        except TypeError: #Maybe pipe is closed now
-            pass
-        self.config.set_wpkg_runningstate('false')
-
-    def GetActivityIndicator(self):
-        # Show for every 10 iteration
-        mod = self.activityvalue % 5
-        self.activityvalue = self.activityvalue + 1
-        if mod == 0:
-            return "...    "
-        if mod == 1:
-            return " ...   "
-        if mod == 2:
-            return "  ...  "
-        if mod == 3:
-            return "   ... "
-        if mod == 4:
-            return "    ..."
-
-    def allowed_to_execute(self):
-        allowed = True
-        block_all = False
-        commandstring = os.path.expandvars(self.wpkg_command)
-        wpkg_path = commandstring.split("wpkg.js", 1)[0]
-        blacklist_path = wpkg_path + 'blacklist.txt'
-        try:
-            with open(blacklist_path, "r") as blacklist_file:
-                data = blacklist_file.readlines()
-            blacklist = []
-            for entry in data:
-                entry = entry.replace('\n', '')
-                if not entry.startswith('#') and entry != '':
-                    blacklist.append(entry.lower().strip())
-                if entry.strip().lower() == '!all!':
-                    # Block all systems from executing
-                    block_all = True
-                    break
-            hostname = os.getenv('computername').lower()
-            # If Hostname in Blacklist don't allow execution
-            if hostname in blacklist:
-                allowed = False
-        except IOError:
-            return allowed
-        if block_all:
-            return False
-        else:
-            return allowed
-
-if __name__=='__main__':
-    import sys, gettext
-    gettext.install('wpkg-gp')
-    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")                        
-    h = logging.StreamHandler(sys.stdout)
-    h.setFormatter(formatter)
-    logger = logging.getLogger("WpkgExecuter")
-    logger.addHandler(h)
-    logger.setLevel(logging.DEBUG)
-    WPKG = WpkgExecuter()
-    WPKG.Execute()
-else:
-    h = NullHandler()
-    logger = logging.getLogger("WpkgService")
-    logger.addHandler(h)
+# -*- coding: utf-8 -*-
+"""WPKGExecuter.py
+Class for executing WPKG
+"""
+import WpkgConfig
+import WpkgWriter
+import WpkgNetworkHandler
+import WpkgOutputParser
+import WpkgRebootHandler
+import WpkgBroadcaster
+import WpkgOutputPump
+import WpkgRunCapture
+import WpkgQueryCache
+import WpkgFingerprint
+import WpkgEngine
+import WpkgWatchdog
+import WpkgBlacklist
+import WpkgHistory
+import WpkgEstimator
+import WpkgTiming
+import WpkgMetrics
+import logging
+import threading
+import contextlib
+import hashlib
+import sys, os, re, subprocess, time
+
+
+METRICS = WpkgMetrics.METRICS
+OUTPUT_BYTES = METRICS.counter("wpkggp_output_bytes_total")
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+class WpkgExecuter():
+    
+    is_running = False
+    
+    def __init__(self, handle=None):
+        self.config = WpkgConfig.WpkgConfig()
+        self.wpkg_command = self.config.get("WpkgCommand")
+        self.codepage = self.config.get_codepage()
+        self.broadcaster = WpkgBroadcaster.WpkgBroadcaster()
+        self.writer = WpkgWriter.WpkgWriter(handle, self.broadcaster)
+        self.lock = threading.Lock()
+        self.proc = None
+        self.query_cache = WpkgQueryCache.WpkgQueryCache(self.config.get("QueryCacheTTL"))
+        self.query_flight = None
+        self.network_handler = WpkgNetworkHandler.WpkgNetworkHandler()
+        self.share_session = None
+        self.history = WpkgHistory.WpkgHistory(os.path.join(self.config.install_path, "logs", "history.db"),
+                                               self.config.get("HistoryDays"))
+        self.record = None
+        self.estimator = WpkgEstimator.WpkgEstimator(self.history, self.config.get("EstimatorSeedFile"),
+                                                     self.config.get("HistoryDays"))
+        self.timings = [] # WpkgTiming of the last runs, oldest first
+        for name in ("hits", "misses", "joined"):
+            METRICS.gauge("wpkggp_query_cache_%s" % name, lambda name=name: self.query_cache.stats()[name])
+        self.parser = WpkgOutputParser.WpkgOutputParser(self.codepage)
+        self.reboot_handler = WpkgRebootHandler.WpkgRebootHandler()
+        self.parse_wpkg_command()
+        self.blacklist = None
+
+        self.activityvalue = 0
+    
+    def parse_wpkg_command(self):
+        commandstring = self.wpkg_command
+        commandstring = os.path.expandvars(commandstring) #Expanding variables
+
+        # check if starts with cscript and contains /noreboot /synchronize
+        # and/or /sendStatus is in command. If not, add it.
+        
+        # split command line by space except when quoted - preserve quotes
+        commandlist = re.findall(r'(?:[^\s"]|"(?:\\.|[^"])*")+', commandstring)
+        is_js_script = False
+        
+        # remove possible quotes before checking whether it is a js script
+        jscommand = re.sub(r'^"|"$', '', commandlist[0]).lower()
+
+        if jscommand == "cscript" or jscommand[-3:]==".js":
+           is_js_script = True
+        if is_js_script == True:
+            if commandlist[0].lower() != "cscript":
+                logger.debug("WpkgCommand is a js file but is missing 'cscript', adding")
+                commandlist.insert(0, "cscript")
+            if not "/noreboot" in commandlist:
+                logger.debug("WpkgCommand is a js but is missing /noreboot, adding")
+                commandlist.append("/noreboot")
+            if not "/synchronize" in commandlist:
+                logger.debug("WpkgCommand is a js but is missing /synchronize, adding")
+                commandlist.append("/synchronize")
+            if not "/sendStatus" in commandlist:
+                logger.debug("WpkgCommand is a js but is missing /sendStatus, adding")
+                commandlist.append("/sendStatus")
+            if not "/nonotify" in commandlist:
+                logger.debug("WpkgCommand is a js but is missing /nonotify, adding")
+                commandlist.append("/nonotify")
+            if not "/quiet" in commandlist:
+                logger.debug("WpkgCommand is a js but is missing /quiet, adding")
+                commandlist.append("/quiet")
+        self.execute_command = " ".join(commandlist)
+
+    def start_task(self):
+        # Returns False if another task is already running
+        with self.lock:
+            if self.is_running:
+                return False
+            self.is_running = True
+        self.broadcaster.start()
+        return True
+
+    def finish_task(self):
+        self.proc = None
+        self.is_running = False
+        self.broadcaster.close()
+
+    def open_share(self):
+        # The connection is reused by the next task if it follows soon
+        self.share_session = self.network_handler.open_session()
+        return self.share_session != None
+
+    def close_share(self):
+        if self.share_session != None:
+            self.share_session.close()
+            self.share_session = None
+
+    def failover(self):
+        # Returns True if the task failed because the mirror it used dropped
+        # out, and should be repeated with another one
+        if not self.network_handler.mirror_failed():
+            return False
+        self.close_share()
+        return True
+
+    def rewrite_environment(self, config_env):
+        return dict([(k, self.network_handler.rewrite(v)) for k, v in config_env.items()])
+
+    def Query(self, handle=None):
+        # Adding query and dryrun parameter to execute command
+        # /dryrun is used to the file date of wpkg.xml is untouched
+        self.query_command = self.execute_command + ' /query:Iudr'
+        with self.lock:
+            flight = self.query_flight
+            leader = False
+            subscription = None
+            if flight == None and not self.is_running:
+                self.is_running = True
+                flight = self.query_flight = WpkgQueryCache.WpkgFlight()
+                leader = True
+                # Started before the lock is released, so every joiner finds
+                # it. Joiners are replayed the whole query.
+                self.broadcaster.start(keep_all=True)
+            elif flight != None:
+                subscription = self.broadcaster.subscribe()
+        if flight == None:
+            logger.info(R"Client requested WPKG to execute query, but WPKG is already running.")
+            msg = "201 " + _("Info: WPKG is already running a task.")
+            writer = WpkgWriter.WpkgWriter(handle)
+            writer.Write(msg)
+            writer.close()
+            return
+        if not leader:
+            # Another client started the same query, stream its messages
+            logger.info(R"Client requested WPKG to execute query, joining the running query.")
+            self.query_cache.join()
+            writer = WpkgWriter.WpkgWriter(handle)
+            if subscription == None:
+                # The query has just finished
+                for msg in flight.wait():
+                    writer.Write(msg)
+            else:
+                while not writer.closed:
+                    messages = subscription.get()
+                    if messages == None:
+                        break
+                    for data in messages:
+                        writer.WriteEncoded(data)
+            writer.close()
+            return
+        self.writer = WpkgWriter.WpkgWriter(handle, self.broadcaster)
+        self.record = self.history.start_run("query")
+        try:
+            with self.timed("Query"):
+                self.DoQuery()
+        finally:
+            self.close_share()
+            self.finish_record()
+            self.query_flight = None
+            flight.finish()
+            self.finish_task()
+            self.writer.close()
+
+    def QueryWrite(self, msg):
+        if self.query_flight.add(msg):
+            self.writer.Write(msg)
+
+    def DoQuery(self, retry=False):
+        # retry is set when the query is repeated on another mirror
+        parsedline = _("Initializing Wpkg-GP software query")
+        if not retry:
+            self.QueryWrite("100 " + parsedline)
+        logger.info(R"Executing WPKG with the command %s" % self.execute_command)
+
+        # Answer from the cache if none of the files wpkg.js reads has
+        # changed, before the share is connected. Unreachable files never
+        # match the key of a cached result. blacklist.txt is part of the
+        # key, so a host added to it is not answered from the cache.
+        with WpkgTiming.span("query cache"):
+            fingerprint = WpkgFingerprint.WpkgFingerprint(self.get_wpkg_path())
+            cache_key = fingerprint.stat_key((self.query_command,), (self.get_blacklist_path(),))
+            results = self.query_cache.lookup(cache_key)
+        if results != None:
+            logger.info(R"Answering query from cache (hits: %(hits)i, misses: %(misses)i, joined: %(joined)i)" %
+                        self.query_cache.stats())
+            for msg in results:
+                self.QueryWrite(msg)
+            return
+        results = []
+
+        # Open the network share as another user, if necessary
+        with WpkgTiming.span("open share"):
+            opened = self.open_share()
+        if not opened:
+            net_msg = _("Error: Connecting to network share failed.")
+            self.QueryWrite("204 " + net_msg)
+            logger.error("Connecting to network share failed. Exiting.")
+            return
+
+        # Check if System is on Blacklist
+        with WpkgTiming.span("blacklist"):
+            allowed = self.allowed_to_execute()
+        if not allowed:
+            net_msg = _("Info: Client was blocked from server to execute wpkg.")
+            self.QueryWrite("205 " + net_msg)
+            logger.info("Client was blocked from server to execute wpkg.")
+            return
+
+        # The result is stored under the key of the files as seen through
+        # the connected share
+        with WpkgTiming.span("cache key"):
+            fingerprint = WpkgFingerprint.WpkgFingerprint(self.get_wpkg_path())
+            cache_key = fingerprint.stat_key((self.query_command,), (self.get_blacklist_path(),))
+        with WpkgTiming.span("estimates"):
+            self.estimator.load()
+
+        if self.config.get("QueryEngine") == "native":
+            with WpkgTiming.span("native query"):
+                records = self.NativeQuery()
+            if records != None:
+                self.close_share()
+                for record in records:
+                    query_msg = self.get_query_message(record)
+                    self.QueryWrite(query_msg)
+                    results.append(query_msg)
+                self.estimator.set_pending(records)
+                if not records:
+                    query_msg = "104 " + _("No pending wpkg tasks")
+                    self.QueryWrite(query_msg)
+                    results.append(query_msg)
+                self.query_cache.store(cache_key, results)
+                return
+
+        # Add environment parameters
+        env = os.environ.copy()
+        config_env = self.config.EnvironmentVariables.get()
+        if config_env != None:
+            env.update(self.rewrite_environment(config_env))
+        # logger.debug(R"Environment variables are: %s" % env)
+
+        # Set wpkg runningstate true
+        self.config.set_wpkg_runningstate('true')
+
+        # Run WPKG Query
+        with WpkgTiming.span("start wpkg.js"):
+            self.proc = subprocess.Popen(self.network_handler.rewrite(self.query_command), stdout=subprocess.PIPE, env=env)
+        pump = WpkgOutputPump.WpkgOutputPump(self.proc)
+        capture = WpkgRunCapture.WpkgRunCapture(os.path.join(self.config.install_path, "logs"), "query",
+                                                keep=self.config.get("RunLogsToKeep"))
+        query_parser = WpkgOutputParser.WpkgQueryParser(self.codepage)
+        watchdog = self.start_watchdog(package_limit=False)
+        records = []
+        first_line = True
+        output_bytes = 0
+
+        # Every package is written to the pipe as soon as wpkg.js has checked it
+        try:
+            with WpkgTiming.span("wpkg.js"):
+                for line in pump.lines():
+                    if first_line:
+                        WpkgTiming.mark("first output")
+                        first_line = False
+                    watchdog.activity()
+                    output_bytes = output_bytes + len(line)
+                    capture.append(line)
+                    record = query_parser.parse_line(line)
+                    if record != None:
+                        records.append(record)
+                        query_msg = self.get_query_message(record)
+                        self.QueryWrite(query_msg)
+                        results.append(query_msg)
+        finally:
+            OUTPUT_BYTES.inc(output_bytes)
+            watchdog.stop()
+            capture.close()
+        exitcode = self.proc.wait()
+        self.record.exitcode = exitcode
+
+        logger.info(R"Finished executing Wpkg.js Query")
+
+        if watchdog.expired == None and exitcode != 0 and self.failover():
+            return self.DoQuery(retry=True)
+
+        # Closing handle to share
+        self.close_share()
+
+        if watchdog.expired != None:
+            self.QueryWrite(self.watchdog_message(watchdog))
+            return
+
+        if exitcode == 1:  # Cscript returned an error
+            logger.error(R"WPKG command returned an error: %s" % capture.last_line())
+            self.QueryWrite("200 " + _("Wpkg returned an error: %s") % capture.last_line())
+            return
+
+        if query_parser.count == 0:
+            query_msg = "104 " + _("No pending wpkg tasks")
+            self.QueryWrite(query_msg)
+            results.append(query_msg)
+        self.estimator.set_pending(records)
+        self.query_cache.store(cache_key, results)
+
+    def get_query_message(self, record):
+        # The expected duration of the task is added if it ran before
+        query_msg = "103 TASK: %s\tNAME: %s\tREVISION: %s" % record
+        duration = self.estimator.task_duration(record[0], record[1])
+        if duration != None:
+            query_msg = query_msg + "\tDURATION: %i" % round(duration)
+        return query_msg
+
+    def NativeQuery(self):
+        # Returns the query result computed without wpkg.js, or None if
+        # wpkg.js has to be used
+        # The variables wpkg.js would be started with
+        environment = None
+        config_env = self.config.EnvironmentVariables.get()
+        if config_env != None:
+            environment = self.rewrite_environment(config_env)
+        return WpkgEngine.native_query(self.get_wpkg_path(), os.getenv("computername"), environment)
+
+    def Execute(self, handle=None, rebootcancel=False, from_gpe=False):
+        if not self.start_task():
+            logger.info(R"Client requested WPKG to execute, but WPKG is already running.")
+            msg = "201 " + _("Info: WPKG is already running a task.")
+            writer = WpkgWriter.WpkgWriter(handle)
+            writer.Write(msg)
+            writer.close()
+            return
+        self.writer = WpkgWriter.WpkgWriter(handle, self.broadcaster)
+        self.record = self.history.start_run("execute")
+        try:
+            with self.timed("Execute"):
+                self.DoExecute(rebootcancel, from_gpe)
+        finally:
+            self.close_share()
+            self.finish_record()
+            self.finish_task()
+            self.writer.close()
+
+    def DoExecute(self, rebootcancel=False, from_gpe=False, retry=False):
+        # retry is set when the run is repeated on another mirror
+        parsedline = _("Initializing Wpkg-GP software installation")
+        if not retry:
+            self.writer.Write("100 " + parsedline)
+        logger.info(R"Executing WPKG with the command %s" % self.execute_command)
+
+        # At bootup the run is skipped if nothing changed since the last
+        # successful one. The configuration is compared first, the files on
+        # the share are only hashed if it is unchanged.
+        check_unchanged = False
+        if from_gpe and self.config.get("SkipUnchangedAtBootUp") == 1:
+            last_fingerprint, last_time, last_config_key = self.config.get_last_fingerprint()
+            max_age = self.config.get("SkipUnchangedMaxAge") * 3600
+            check_unchanged = last_fingerprint != None and time.time() - last_time < max_age and \
+                              last_config_key == self.get_config_key()
+
+        #Open the network share as another user, if necessary
+        with WpkgTiming.span("open share"):
+            opened = self.open_share()
+        if not opened:
+            net_msg = _("Error: Connecting to network share failed.")
+            self.writer.Write("204 " + net_msg)
+            logger.error("Connecting to network share failed. Exiting.")
+            if not rebootcancel:
+                time.sleep(2)
+            return
+
+        # Check if System is on Blacklist
+        with WpkgTiming.span("blacklist"):
+            allowed = self.allowed_to_execute()
+        if not allowed:
+            net_msg = _("Info: Client was blocked from server to execute wpkg.")
+            self.writer.Write("205 " + net_msg)
+            logger.info("Client was blocked from server to execute wpkg.")
+            if not rebootcancel:
+                # Enough time to see the message during bootup
+                time.sleep(4)
+            return
+
+        # Add environment parameters
+        env = os.environ.copy()
+        config_env = self.config.EnvironmentVariables.get()
+        if config_env != None:
+            env.update(self.rewrite_environment(config_env))
+        #logger.debug(R"Environment variables are: %s" % env)
+
+        if check_unchanged and last_fingerprint == self.get_fingerprint(config_env):
+            logger.info("Nothing changed since the last successful run, skipping execution at bootup")
+            self.writer.Write("106 " + _("Info: Nothing changed since the last synchronization."))
+            self.close_share()
+            return
+
+        # Set wpkg runningstate true
+        self.config.set_wpkg_runningstate('true')
+
+        show_estimates = self.config.get("ShowEstimates") == 1
+        if show_estimates:
+            with WpkgTiming.span("estimates"):
+                self.estimator.load()
+
+        # Run WPKG
+        with WpkgTiming.span("start wpkg.js"):
+            self.proc = subprocess.Popen(self.network_handler.rewrite(self.execute_command), stdout=subprocess.PIPE, env=env)
+        pump = WpkgOutputPump.WpkgOutputPump(self.proc)
+        capture = WpkgRunCapture.WpkgRunCapture(os.path.join(self.config.install_path, "logs"), "execute",
+                                                keep=self.config.get("RunLogsToKeep"))
+
+        self.parsedline = parsedline
+        self.lastsec = None
+        self.estimate = ""
+        self.estimator.start()
+        ticker = None
+        if self.config.get("WpkgActivityIndicator") == 1:
+            ticker = WpkgOutputPump.WpkgTicker(1, self.ShowActivity)
+
+        watchdog = self.start_watchdog()
+        # Every package gets a line in the timing breakdown
+        steps = None
+        if WpkgTiming.current() != None:
+            steps = WpkgTiming.WpkgStepTimer(WpkgTiming.current())
+        first_line = True
+        output_bytes = 0
+
+        #Reading lines until wpkg is finished
+        try:
+            with WpkgTiming.span("wpkg.js"):
+                for line in pump.lines():
+                    if first_line:
+                        WpkgTiming.mark("first output")
+                        first_line = False
+                    output_bytes = output_bytes + len(line)
+                    capture.append(line)
+                    event = self.parser.parse_line(line)
+                    # Every line counts as output, not only status lines
+                    watchdog.activity(event and event.package)
+                    if event != None:
+                        self.record.event(event)
+                        self.estimator.update(event)
+                        if steps != None:
+                            steps.next("%s %s" % (event.phase, event.package), event.phase)
+                    if self.parser.updated:
+                        self.parsedline = self.parser.get_formatted_line()
+                        if show_estimates:
+                            self.estimate = self.estimator.get_formatted_estimate()
+                        self.writer.Write("100 %s%s      " % (self.parsedline, self.estimate))
+                        self.lastsec = time.time() # Reset timer
+                if steps != None:
+                    steps.close()
+        finally:
+            OUTPUT_BYTES.inc(output_bytes)
+            watchdog.stop()
+            if ticker != None:
+                ticker.stop()
+            capture.close()
+
+        self.parser.reset()
+        
+        exitcode = self.proc.wait()
+        self.record.exitcode = exitcode
+        if exitcode in (0, 770560):
+            # The pending tasks have been performed
+            self.estimator.set_pending([])
+        # The installed packages may have changed
+        self.query_cache.invalidate()
+        if watchdog.expired == None and exitcode not in (0, 770560) and self.failover():
+            self.writer.Write("100 " + _("The software share dropped out, continuing with another copy"))
+            return self.DoExecute(rebootcancel, from_gpe, retry=True)
+        self.config.set_watchdog_result(watchdog.expired, watchdog.expired_package)
+        if watchdog.expired == None and exitcode == 0 and self.config.get("SkipUnchangedAtBootUp") == 1:
+            # Computed after the run, as wpkg.js has updated the local wpkg.xml
+            self.config.set_last_fingerprint(self.get_fingerprint(config_env), self.get_config_key())
+        else:
+            self.config.set_last_fingerprint(None)
+        #Closing handle to share
+        self.close_share()
+        logger.info(R"Finished executing Wpkg.js")
+
+        if watchdog.expired != None:
+            self.writer.Write(self.watchdog_message(watchdog))
+            return
+
+        if exitcode == 1: #Cscript returned an error
+            logger.error(R"WPKG command returned an error: %s" % capture.last_line())
+            self.writer.Write("200 " + _("Wpkg returned an error: %s") % capture.last_line())
+            return
+        
+        if exitcode == 770560: #WPKG returns this when it requests a reboot
+            logger.info(R"WPKG requested a reboot")
+            with WpkgTiming.span("reboot decision"):
+                status = self.reboot_handler.reboot(rebootcancel)
+            self.record.reboot = WpkgRebootHandler.DECISIONS.get(self.reboot_handler.status)
+            self.writer.Write(status)
+        else:
+            self.reboot_handler.reset_reboot_number()
+
+        self.config.set_wpkg_synctime()
+
+    def Cancel(self, handle=None):
+        proc = self.proc
+        if self.is_running and proc != None:
+            WpkgWatchdog.kill_tree(proc)
+            logger.info("Cancel called, WPKG process was killed.")
+            msg = "105 " + _("Cancel called, WPKG process was killed")
+        else:
+            logger.info("Cancel called, but WPKG process was not running")
+            msg = "202 " + _("Cancel called, WPKG process was not running")
+        writer = WpkgWriter.WpkgWriter(handle)
+        writer.Write(msg)
+        writer.close()
+        self.config.set_wpkg_runningstate('false')
+
+    def start_watchdog(self, package_limit=True):
+        # The timeouts are configured in minutes
+        package = 0
+        if package_limit:
+            package = self.config.get("WpkgPackageTimeout") * 60
+        return WpkgWatchdog.WpkgWatchdog(self.proc, stall=self.config.get("WpkgTimeout") * 60,
+                                         run=self.config.get("WpkgRunTimeout") * 60, package=package)
+
+    def watchdog_message(self, watchdog):
+        package = watchdog.expired_package or _("unknown package")
+        if watchdog.expired == "stall":
+            msg = _("Error: WPKG was stopped, no output for %i minutes while processing %s") % \
+                  (watchdog.limits["stall"] / 60, package)
+        elif watchdog.expired == "package":
+            msg = _("Error: WPKG was stopped, %s took longer than %i minutes") % \
+                  (package, watchdog.limits["package"] / 60)
+        else:
+            msg = _("Error: WPKG was stopped, the run took longer than %i minutes while processing %s") % \
+                  (watchdog.limits["run"] / 60, package)
+        return "211 " + msg
+
+    def Attach(self, handle=None, done=None):
+        # Hands the client to the broadcaster, which streams the messages of
+        # the running task to it without holding the calling thread. done is
+        # called when the task has ended. Returns False if no task is running,
+        # the client is then left to the caller.
+        writer = WpkgWriter.WpkgWriter(handle)
+        if not self.broadcaster.attach(writer, done):
+            logger.info("Attach called, but WPKG is not running")
+            writer.Write("210 " + _("Attach called, but WPKG is not running"))
+            writer.close()
+            return False
+        logger.info("Client attached to the running task")
+        return True
+
+    @contextlib.contextmanager
+    def timed(self, kind):
+        # Times the task performed within the block, unless RunTimingsToKeep is 0
+        keep = self.config.get("RunTimingsToKeep")
+        if keep <= 0:
+            yield None
+            return
+        timing = WpkgTiming.WpkgTiming("%s at %s" % (kind, time.strftime("%Y-%m-%d %H:%M:%S")))
+        try:
+            with timing.activate():
+                yield timing
+        finally:
+            logger.info(timing.report(0))
+            with self.lock:
+                self.timings = (self.timings + [timing])[-keep:]
+
+    def Timings(self, handle=None, count=5):
+        # Sends the timing breakdown of the last count runs, one line per message
+        writer = WpkgWriter.WpkgWriter(handle)
+        with self.lock:
+            timings = self.timings[-count:]
+        if not timings:
+            writer.Write("107 " + _("No run has been timed yet"))
+        for timing in timings:
+            for line in timing.report(0).split("\n"):
+                writer.Write("107 " + line)
+        writer.close()
+
+    def finish_record(self):
+        status = self.get_status_code()
+        self.record.finish(status)
+        METRICS.histogram("wpkggp_run_seconds", WpkgMetrics.DURATION_BUCKETS, kind=self.record.kind).observe(
+            self.record.finished - self.record.started)
+        METRICS.counter("wpkggp_runs_total", kind=self.record.kind, status=status or "none").inc()
+
+    def get_status_code(self):
+        # The status code of the last message written by the task
+        data = self.broadcaster.last_message()
+        if data == None:
+            return None
+        return data[:3]
+
+    def getStatus(self):
+        # The last message written by the running task, without status code
+        data = self.broadcaster.last_message()
+        if data == None:
+            return _("Info: WPKG is already running a task.")
+        return data[4:]
+
+    def get_fingerprint(self, config_env):
+        with WpkgTiming.span("fingerprint"):
+            return self.get_content_key(config_env)
+
+    def get_config_key(self):
+        # Cheap to compute, changes with the command and the configuration
+        return hashlib.sha1("%s\0%s" % (self.execute_command, self.config.snapshot.key())).hexdigest()
+
+    def get_content_key(self, config_env):
+        fingerprint = WpkgFingerprint.WpkgFingerprint(self.get_wpkg_path())
+        extra = [self.execute_command]
+        if config_env != None:
+            extra.extend(["%s=%s" % item for item in sorted(config_env.items())])
+        return fingerprint.content_key(extra)
+
+    def ShowActivity(self):
+        # Called every second while wpkg is running
+        lastsec = self.lastsec
+        if lastsec != None and time.time() - lastsec >= 1: #Show every 1 sec
+            if self.estimate:
+                # Counts down while a package is installed
+                self.estimate = self.estimator.get_formatted_estimate()
+            self.writer.Write("101 %s%s%s" % (self.parsedline, self.estimate, self.GetActivityIndicator()))
+
+    def GetActivityIndicator(self):
+        # Show for every 10 iteration
+        mod = self.activityvalue % 5
+        self.activityvalue = self.activityvalue + 1
+        if mod == 0:
+            return "...    "
+        if mod == 1:
+            return " ...   "
+        if mod == 2:
+            return "  ...  "
+        if mod == 3:
+            return "   ... "
+        if mod == 4:
+            return "    ..."
+
+    def get_wpkg_path(self):
+        # The directory of wpkg.js on the mirror in use
+        return WpkgFingerprint.get_wpkg_path(self.network_handler.rewrite(self.wpkg_command))
+
+    def get_blacklist_path(self):
+        return os.path.join(self.get_wpkg_path(), "blacklist.txt")
+
+    def allowed_to_execute(self):
+        # blacklist.txt is read from the mirror in use, the parsed rules are
+        # kept while the mirror does not change
+        path = self.get_blacklist_path()
+        if self.blacklist == None or self.blacklist.path != path:
+            self.blacklist = WpkgBlacklist.WpkgBlacklist(path)
+        return not self.blacklist.is_blocked(os.getenv('computername'))
+
+if __name__=='__main__':
+    import sys, gettext
+    gettext.install('wpkg-gp')
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")                        
+    h = logging.StreamHandler(sys.stdout)
+    h.setFormatter(formatter)
+    logger = logging.getLogger("WpkgExecuter")
+    logger.addHandler(h)
+    logger.setLevel(logging.DEBUG)
+    WPKG = WpkgExecuter()
+    WPKG.Execute()
+else:
+    h = NullHandler()
+    logger = logging.getLogger("WpkgService")
+    logger.addHandler(h)
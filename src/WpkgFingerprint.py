@@ -0,0 +1,90 @@
+"""WpkgFingerprint.py
+Identifies the state of the files wpkg.js evaluates
+"""
+import os
+import re
+import hashlib
+import socket
+
+# wpkg.js reads either the xml file or all xml files in the directory
+SERVER_FILES = ("hosts", "profiles", "packages")
+
+
+def get_wpkg_path(command):
+    # Returns the directory of wpkg.js in command, with trailing backslash
+    path = os.path.expandvars(command).split("wpkg.js", 1)[0]
+    if '"' in path:
+        return path.rsplit('"', 1)[1]
+    elif path.strip() == "":
+        return ""
+    return re.split(r'\s', path)[-1]
+
+
+def get_local_wpkg_xml():
+    return os.path.join(os.environ.get("SystemRoot", R"C:\Windows"), "system32", "wpkg.xml")
+
+
+def get_host_identity():
+    hostname = (os.getenv("computername") or socket.gethostname()).lower()
+    domain = (os.getenv("userdnsdomain") or "").lower()
+    return "%s.%s" % (hostname, domain)
+
+
+class WpkgFingerprint(object):
+    def __init__(self, wpkg_path):
+        self.wpkg_path = wpkg_path
+
+    def files(self):
+        # All files wpkg.js reads when evaluating this host
+        files = []
+        for name in SERVER_FILES:
+            path = os.path.join(self.wpkg_path, name + ".xml")
+            if os.path.isfile(path):
+                files.append(path)
+            directory = os.path.join(self.wpkg_path, name)
+            if os.path.isdir(directory):
+                for f in sorted(os.listdir(directory)):
+                    if f.lower().endswith(".xml"):
+                        files.append(os.path.join(directory, f))
+        files.append(get_local_wpkg_xml())
+        return files
+
+    def stat_key(self, extra=(), extra_files=()):
+        # A cheap key built from size and modification time of every file,
+        # and of extra_files. Costs one stat per file, the files are not read.
+        digest = hashlib.sha1()
+        digest.update(get_host_identity())
+        for item in extra:
+            digest.update("\0%s" % (item,))
+        for path in self.files() + list(extra_files):
+            try:
+                st = os.stat(path)
+                digest.update("\0%s\0%i\0%r" % (path.lower(), st.st_size, st.st_mtime))
+            except OSError:
+                digest.update("\0%s\0missing" % path.lower())
+        return digest.hexdigest()
+
+    def content_key(self, extra=()):
+        # A key built from the contents of every file, used to decide if
+        # anything changed since the last successful run
+        digest = hashlib.sha1()
+        digest.update(get_host_identity())
+        for item in extra:
+            digest.update("\0%s" % (item,))
+        for path in self.files():
+            # Relative to wpkg.js, so every mirror of the share gives the
+            # same key
+            name = path.lower()
+            if self.wpkg_path and name.startswith(self.wpkg_path.lower()):
+                name = name[len(self.wpkg_path):]
+            digest.update("\0%s\0" % name)
+            try:
+                with open(path, "rb") as f:
+                    while 1:
+                        data = f.read(65536)
+                        if not data:
+                            break
+                        digest.update(data)
+            except IOError:
+                digest.update("missing")
+        return digest.hexdigest()
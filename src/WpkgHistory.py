@@ -0,0 +1,217 @@
+"""WpkgHistory.py
+Keeps the history of every run in a SQLite database
+
+Runs are collected in memory while they are running and written in one
+transaction when they have finished, by a background thread owning the
+database connection. Nothing is written while wpkg.js reports progress.
+"""
+import time
+import sqlite3
+import logging
+import threading
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue  # python 3.x
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL,
+    exitcode INTEGER,
+    reboot TEXT,
+    status TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE TABLE IF NOT EXISTS operations (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    package TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS operations_run ON operations (run_id);
+CREATE INDEX IF NOT EXISTS operations_started ON operations (started, package, phase, finished);
+CREATE INDEX IF NOT EXISTS operations_package ON operations (package, phase, started);
+"""
+
+# Compact the database after this many runs
+COMPACT_EVERY = 50
+
+STOP = object()
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+class WpkgRunRecord(object):
+    # One run, filled while it runs and stored when finish() is called
+    def __init__(self, history, kind):
+        self.history = history
+        self.kind = kind
+        self.started = time.time()
+        self.finished = None
+        self.exitcode = None
+        self.reboot = None
+        self.status = None
+        self.operations = [] # [package, phase, started, finished]
+        self.current = None
+
+    def event(self, event):
+        # Called with every WpkgStatusEvent, opens a new operation when the
+        # package or the phase changes
+        if event.phase == None:
+            return
+        current = self.current
+        if current != None and current[0] == event.package and current[1] == event.phase:
+            return
+        now = time.time()
+        if current != None:
+            current[3] = now
+        self.current = [event.package, event.phase, now, None]
+        self.operations.append(self.current)
+
+    def finish(self, status=None):
+        self.finished = time.time()
+        if self.current != None:
+            self.current[3] = self.finished
+            self.current = None
+        if status != None:
+            self.status = status
+        self.history.store(self)
+
+
+class WpkgHistory(object):
+    def __init__(self, path, keep_days=90):
+        self.path = path
+        self.keep_days = keep_days
+        self.queue = Queue()
+        self.stored = 0
+        t = threading.Thread(target=self.run)
+        t.daemon = True
+        t.start()
+
+    def start_run(self, kind):
+        return WpkgRunRecord(self, kind)
+
+    def store(self, record):
+        self.queue.put(("store", record, None))
+
+    def read(self, fn, *args):
+        # Runs fn(connection, *args) on the database thread and returns its
+        # result, or None if the database is not available
+        result = []
+        done = threading.Event()
+        self.queue.put(("read", (fn, args, result), done))
+        done.wait()
+        if result:
+            return result[0]
+        return None
+
+    def close(self):
+        self.queue.put((STOP, None, None))
+
+    def connect(self):
+        try:
+            connection = sqlite3.connect(self.path)
+            connection.executescript(SCHEMA)
+            return connection
+        except sqlite3.Error, e:
+            logger.error("Unable to open run history %s: %s" % (self.path, e))
+            return None
+
+    def run(self):
+        connection = self.connect()
+        if connection != None:
+            self.compact(connection)
+        while 1:
+            action, item, done = self.queue.get()
+            if action is STOP:
+                break
+            try:
+                if connection == None:
+                    pass
+                elif action == "store":
+                    self.insert(connection, item)
+                    self.stored = self.stored + 1
+                    if self.stored % COMPACT_EVERY == 0:
+                        self.compact(connection)
+                elif action == "read":
+                    fn, args, result = item
+                    result.append(fn(connection, *args))
+            except sqlite3.Error, e:
+                logger.error("Run history error: %s" % e)
+            except Exception:
+                # Keeps the thread alive for the next items
+                logger.exception("Unexpected run history error:")
+            finally:
+                if done != None:
+                    done.set()
+        if connection != None:
+            connection.close()
+
+    def insert(self, connection, record):
+        with connection:
+            cursor = connection.execute(
+                "INSERT INTO runs (kind, started, finished, exitcode, reboot, status) VALUES (?, ?, ?, ?, ?, ?)",
+                (record.kind, record.started, record.finished, record.exitcode, record.reboot, record.status))
+            run_id = cursor.lastrowid
+            connection.executemany(
+                "INSERT INTO operations (run_id, package, phase, started, finished) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, package.decode("utf-8"), phase, started, finished)
+                 for package, phase, started, finished in record.operations])
+
+    def compact(self, connection):
+        # Removes runs older than keep_days, and gives the space back when
+        # a good part of the file is unused
+        if self.keep_days <= 0:
+            return
+        limit = time.time() - self.keep_days * 86400
+        with connection:
+            connection.execute("DELETE FROM operations WHERE run_id IN (SELECT id FROM runs WHERE started < ?)", (limit,))
+            connection.execute("DELETE FROM runs WHERE started < ?", (limit,))
+        pages = connection.execute("PRAGMA page_count").fetchone()[0]
+        free = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        if pages > 0 and free * 4 > pages:
+            logger.debug("Compacting run history, %i of %i pages are free" % (free, pages))
+            connection.execute("VACUUM")
+
+
+def slowest_packages(connection, days=30, limit=10):
+    # [(package, phase, count, average seconds, longest seconds), ...]
+    return connection.execute(
+        "SELECT package, phase, COUNT(*), AVG(finished - started), MAX(finished - started) FROM operations "
+        "WHERE started >= ? AND phase IN ('installing', 'upgrading', 'removing') "
+        "GROUP BY package, phase ORDER BY AVG(finished - started) DESC LIMIT ?",
+        (time.time() - days * 86400, limit)).fetchall()
+
+
+def last_runs(connection, limit=10):
+    return connection.execute(
+        "SELECT kind, started, finished - started, exitcode, reboot, status FROM runs "
+        "ORDER BY started DESC LIMIT ?", (limit,)).fetchall()
+
+h = NullHandler()
+logger = logging.getLogger("WpkgService")
+logger.addHandler(h)
+
+if __name__=='__main__':
+    import sys
+    if len(sys.argv) < 2:
+        print "Usage: %s history.db [days]" % sys.argv[0]
+        sys.exit(1)
+    history = WpkgHistory(sys.argv[1], 0)
+    days = len(sys.argv) > 2 and int(sys.argv[2]) or 30
+    print "Slowest packages in the last %i days:" % days
+    for package, phase, count, average, longest in history.read(slowest_packages, days, 20) or []:
+        print "  %-40s %-10s %5i runs %8.1f s average %8.1f s longest" % (package, phase, count, average, longest)
+    print "Last runs:"
+    for kind, started, duration, exitcode, reboot, status in history.read(last_runs, 10) or []:
+        print "  %s %-8s %8.1f s exit code %s reboot %s status %s" % (
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)), kind, duration or 0, exitcode, reboot, status)
+    history.close()
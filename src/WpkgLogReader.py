@@ -0,0 +1,407 @@
+"""WpkgLogReader.py
+Reads parts of the service log and of the run logs for the Logs command
+
+    Logs [service | runs | run | <run id>]
+         [tail <lines> | last <minutes> | since <time> [until <time>] |
+          bytes <offset> <length>] [gzip]
+
+service is the default log, run the latest run log and runs lists the
+run logs. Times are local, e.g. 2026-10-18T08:00 or 2026-10-18T08:00:30.
+The data is sent as 109 messages, or as one zlib stream split into 110
+messages with gzip.
+
+The current service log is read through a memory map, a sparse index of
+line times to offsets finds the start of a time window without scanning
+the file. Only the rotated service logs overlapping the window are
+read. Run logs are read member by member with their .idx file.
+"""
+import os
+import re
+import glob
+import gzip
+import mmap
+import time
+import zlib
+import bisect
+import logging
+import threading
+
+# Lines written by logging and by wpkg.js start with their time, which
+# sorts like a string
+LINE_TIME = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", re.MULTILINE)
+KEY_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Bytes between two entries of the index
+INDEX_STEP = 65536
+# Bytes of log data per message
+CHUNK_SIZE = 65536
+# Messages queued for a slow client before reading further
+QUEUED_CHUNKS = 4
+# Longest byte range sent at once
+MAX_BYTES = 16777216
+DEFAULT_TAIL = 100
+# Largest values accepted for tail and last
+MAX_TAIL = 100000
+MAX_MINUTES = 527040 # A year
+# Offsets stay within a 32 bit index, also with the length added
+MAX_OFFSET = 2**31 - 1 - MAX_BYTES
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+class WpkgLogRequestError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+
+def get_key(seconds):
+    return time.strftime(KEY_FORMAT, time.localtime(seconds))
+
+
+def parse_time(text):
+    for time_format in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(text, time_format))
+        except (ValueError, OverflowError):
+            pass
+    raise WpkgLogRequestError("Invalid time %s, use e.g. 2026-10-18T08:00" % text)
+
+
+def parse_int(text, maximum=None):
+    # A number from 0 on, larger ones are cut to maximum
+    try:
+        value = int(text)
+    except ValueError:
+        raise WpkgLogRequestError("Invalid number %s" % text)
+    if value < 0:
+        raise WpkgLogRequestError("Negative number %s" % text)
+    if maximum != None:
+        value = min(value, maximum)
+    return value
+
+
+class WpkgLogRequest(object):
+    def __init__(self, command):
+        args = command.split()[1:]
+        self.compress = "gzip" in args
+        args = [arg for arg in args if arg != "gzip"]
+        self.target = "service"
+        if args and args[0] not in ("tail", "last", "since", "bytes"):
+            self.target = args.pop(0)
+        self.mode = "tail"
+        self.lines = DEFAULT_TAIL
+        self.since = self.until = None
+        self.offset = self.length = None
+        if not args:
+            return
+        self.mode = args[0]
+        if self.mode == "tail" and len(args) == 2:
+            self.lines = parse_int(args[1], MAX_TAIL)
+        elif self.mode == "last" and len(args) == 2:
+            self.mode = "since"
+            self.since = time.time() - parse_int(args[1], MAX_MINUTES) * 60
+        elif self.mode == "since" and len(args) in (2, 4) and (len(args) == 2 or args[2] == "until"):
+            self.since = parse_time(args[1])
+            if len(args) == 4:
+                self.until = parse_time(args[3])
+        elif self.mode == "bytes" and len(args) == 3:
+            self.offset = parse_int(args[1], MAX_OFFSET)
+            self.length = parse_int(args[2], MAX_BYTES)
+        else:
+            raise WpkgLogRequestError("Invalid request: %s" % command)
+
+
+def find_line(buf, key, pos=0, after=False):
+    # Offset of the first line from pos on with a time from key on (after
+    # key with after), the end of buf if there is none
+    for match in LINE_TIME.finditer(buf, pos):
+        line_key = match.group(1)
+        if line_key > key or (not after and line_key == key):
+            return match.start()
+    return len(buf)
+
+
+def tail_offset(buf, lines):
+    # Offset of the start of the last lines lines of buf
+    pos = len(buf)
+    if pos > 0 and buf[pos - 1] == "\n":
+        pos = pos - 1
+    for i in xrange(lines):
+        pos = buf.rfind("\n", 0, pos)
+        if pos < 0:
+            return 0
+    return pos + 1
+
+
+def cut_window(buf, since_key, until_key, since_hint=0, until_hint=None):
+    start = find_line(buf, since_key, since_hint)
+    if until_key == None:
+        return buf[start:]
+    end = find_line(buf, until_key, max(start, until_hint or 0), after=True)
+    return buf[start:end]
+
+
+class MappedFile(object):
+    # A file mapped read only, an empty buffer for empty or missing files.
+    # Should be kept only for a moment, the log can not be rotated while
+    # it is mapped.
+    def __init__(self, path):
+        self.file = None
+        self.buf = ""
+        try:
+            self.file = open(path, "rb")
+            if os.fstat(self.file.fileno()).st_size > 0:
+                self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, EnvironmentError):
+            self.close()
+
+    def __enter__(self):
+        return self.buf
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        if not isinstance(self.buf, str):
+            self.buf.close()
+            self.buf = ""
+        if self.file != None:
+            self.file.close()
+            self.file = None
+
+
+class WpkgLogIndex(object):
+    # The time of the first line after every INDEX_STEP bytes of the
+    # service log -> its offset. Only what was written since the last
+    # update is scanned, a rotated log is indexed from the start.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset("")
+
+    def reset(self, head):
+        self.keys = []
+        self.offsets = []
+        self.next = 0
+        self.head = head
+
+    def update(self, buf):
+        with self.lock:
+            head = buf[:64]
+            if head != self.head or len(buf) < self.next - INDEX_STEP:
+                self.reset(head)
+            while self.next < len(buf):
+                match = LINE_TIME.search(buf, self.next)
+                if match == None:
+                    break
+                self.keys.append(match.group(1))
+                self.offsets.append(match.start())
+                self.next = match.start() + INDEX_STEP
+
+    def find(self, key):
+        # An offset before the first line from key on
+        with self.lock:
+            i = bisect.bisect_left(self.keys, key)
+            if i == 0:
+                return 0
+            return self.offsets[i - 1]
+
+
+class WpkgServiceLog(object):
+    def __init__(self, path):
+        self.path = path
+        self.index = WpkgLogIndex()
+
+    def get_archives(self):
+        # [(time of the rotation, path)] of the rotated logs, oldest first.
+        # A log is only compressed some time after the rotation.
+        base, ext = os.path.splitext(self.path)
+        paths = set(glob.glob("%s-*%s.gz" % (base, ext)))
+        paths.update([path for path in glob.glob("%s-*%s" % (base, ext)) if path + ".gz" not in paths])
+        archives = []
+        for path in paths:
+            match = re.search(r"-(\d{8}-\d{6})(?:-(\d+))?%s(?:\.gz)?$" % re.escape(ext), path)
+            if match != None:
+                key = time.strftime(KEY_FORMAT, time.strptime(match.group(1), "%Y%m%d-%H%M%S"))
+                # Several rotations within a second are numbered from 2
+                archives.append((key, int(match.group(2) or 1), path))
+        return [(key, path) for key, i, path in sorted(archives)]
+
+    def read(self, request):
+        if request.mode == "since":
+            return self.read_window(get_key(request.since), request.until and get_key(request.until))
+        with MappedFile(self.path) as buf:
+            if request.mode == "bytes":
+                return [buf[request.offset:request.offset + request.length]]
+            return [buf[tail_offset(buf, request.lines):]]
+
+    def read_window(self, since_key, until_key):
+        chunks = []
+        start_key = ""
+        for end_key, path in self.get_archives():
+            # Each rotated log holds the lines from the previous rotation on
+            if end_key >= since_key and (until_key == None or start_key <= until_key):
+                try:
+                    if path.endswith(".gz"):
+                        archive = gzip.open(path, "rb")
+                    else:
+                        archive = open(path, "rb")
+                    try:
+                        chunks.append(cut_window(archive.read(), since_key, until_key))
+                    finally:
+                        archive.close()
+                except (IOError, OSError), e:
+                    logger.info("Unable to read %s: %s" % (path, e))
+            start_key = end_key
+        with MappedFile(self.path) as buf:
+            self.index.update(buf)
+            until_hint = until_key and self.index.find(until_key)
+            chunks.append(cut_window(buf, since_key, until_key, self.index.find(since_key), until_hint))
+        return chunks
+
+
+class WpkgRunLog(object):
+    # A run log written by WpkgRunCapture, a series of gzip members listed
+    # in the .idx file next to it
+    def __init__(self, rundir, run_id):
+        self.path = os.path.join(rundir, run_id + ".log.gz")
+        self.members = [] # [(compressed offset, uncompressed offset, first line, time)]
+        try:
+            with open(os.path.join(rundir, run_id + ".idx"), "r") as index:
+                for line in index:
+                    fields = line.split()
+                    if len(fields) == 4:
+                        self.members.append((int(fields[0]), int(fields[1]), int(fields[2]), float(fields[3])))
+        except (IOError, ValueError):
+            raise WpkgLogRequestError("No run log %s" % run_id)
+
+    def read_members(self, first, last):
+        # The uncompressed data of the members first to last - 1
+        chunks = []
+        with MappedFile(self.path) as buf:
+            for i in range(max(first, 0), min(last, len(self.members))):
+                end = len(buf)
+                if i + 1 < len(self.members):
+                    end = self.members[i + 1][0]
+                chunks.append(zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(buf[self.members[i][0]:end]))
+        return chunks
+
+    def read(self, request):
+        if request.mode == "since":
+            times = [member[3] for member in self.members]
+            first = bisect.bisect_right(times, request.since) - 1
+            last = len(self.members)
+            if request.until != None:
+                last = bisect.bisect_right(times, request.until)
+            data = "".join(self.read_members(first, last))
+            return [cut_window(data, get_key(request.since), request.until and get_key(request.until))]
+        if request.mode == "bytes":
+            offsets = [member[1] for member in self.members]
+            first = bisect.bisect_right(offsets, request.offset) - 1
+            last = bisect.bisect_left(offsets, request.offset + request.length)
+            skip = request.offset - (first >= 0 and offsets[first] or 0)
+            data = "".join(self.read_members(first, last))
+            return [data[skip:skip + request.length]]
+        # The last members until they hold enough lines
+        chunks = []
+        lines = 0
+        i = len(self.members)
+        while i > 0 and lines <= request.lines:
+            i = i - 1
+            chunk = self.read_members(i, i + 1)[0]
+            chunks.insert(0, chunk)
+            lines = lines + chunk.count("\n")
+        data = "".join(chunks)
+        return [data[tail_offset(data, request.lines):]]
+
+
+class WpkgLogReader(object):
+    def __init__(self, logdir):
+        self.rundir = os.path.join(logdir, "runs")
+        self.service_log = WpkgServiceLog(os.path.join(logdir, "WpkgService.log"))
+
+    def get_runs(self):
+        try:
+            return sorted([name[:-len(".log.gz")] for name in os.listdir(self.rundir) if name.endswith(".log.gz")])
+        except OSError:
+            return []
+
+    def read(self, request):
+        # Returns the requested data as a list of strings
+        if request.target == "service":
+            return self.service_log.read(request)
+        runs = self.get_runs()
+        if request.target == "runs":
+            return ["".join(["%s\n" % run_id for run_id in runs])]
+        run_id = request.target
+        if run_id == "run":
+            if not runs:
+                raise WpkgLogRequestError("No run log has been written yet")
+            run_id = runs[-1]
+        elif run_id not in runs:
+            raise WpkgLogRequestError("No run log %s" % run_id)
+        return WpkgRunLog(self.rundir, run_id).read(request)
+
+    def send(self, writer, command):
+        # Answers a Logs command, see the top of this file
+        try:
+            try:
+                request = WpkgLogRequest(command)
+                chunks = self.read(request)
+            except (ValueError, OverflowError), e:
+                # E.g. a time the platform can not represent
+                raise WpkgLogRequestError("Invalid request: %s (%s)" % (command, e))
+        except WpkgLogRequestError, e:
+            writer.Write("212 " + _("Error: %s") % e.value)
+            return
+        code = "109 "
+        compressor = None
+        if request.compress:
+            code = "110 "
+            compressor = zlib.compressobj(6)
+        for data in chunks:
+            for pos in range(0, len(data), CHUNK_SIZE):
+                piece = data[pos:pos + CHUNK_SIZE]
+                if compressor != None:
+                    piece = compressor.compress(piece) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                writer.WriteEncoded(code + piece)
+                writer.wait(QUEUED_CHUNKS)
+        if compressor != None:
+            writer.WriteEncoded(code + compressor.flush())
+
+h = NullHandler()
+logger = logging.getLogger("WpkgService")
+logger.addHandler(h)
+
+if __name__=='__main__':
+    # Times reading the last hour of a large service log, compared to
+    # reading the whole log
+    import sys, random, tempfile, shutil
+    size = (len(sys.argv) > 1 and int(sys.argv[1]) or 100) * 1048576
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "WpkgService.log")
+    started = time.time() - 30 * 86400
+    with open(path, "wb") as f:
+        written = 0
+        line_time = started
+        while written < size:
+            line = "%s,%03i - WpkgService - DEBUG - Writing '100 Wpkg-GP is verifying 'package %i' (1/2)' to pipe\n" % (
+                get_key(line_time), random.randint(0, 999), random.randint(0, 999))
+            f.write(line)
+            written = written + len(line)
+            line_time = line_time + 30 * 86400.0 * len(line) / size
+    log = WpkgServiceLog(path)
+    request = WpkgLogRequest("Logs last 60")
+    for name in ("first read", "second read"):
+        begin = time.time()
+        data = "".join(log.read(request))
+        print "%-12s %8.1f ms, %i bytes of the last hour" % (name, (time.time() - begin) * 1000, len(data))
+    begin = time.time()
+    with open(path, "rb") as f:
+        data = cut_window(f.read(), get_key(request.since), None)
+    print "%-12s %8.1f ms, %i bytes of the last hour" % ("full scan", (time.time() - begin) * 1000, len(data))
+    shutil.rmtree(directory)
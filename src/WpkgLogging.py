@@ -0,0 +1,320 @@
+"""WpkgLogging.py
+Writes the service log from a background thread
+
+Threads logging a message only put it into a queue, the log file is
+written by a separate thread, so a slow disk never holds up a run. When
+the log reaches its size limit it is renamed to
+WpkgService-YYYYmmdd-HHMMSS.log and compressed to a .log.gz by a third
+thread, and the oldest logs are deleted while all logs together are larger
+than the budget.
+"""
+import os
+import sys
+import glob
+import gzip
+import time
+import shutil
+import logging
+import threading
+import collections
+import WpkgMetrics
+
+# Records waiting to be written before DEBUG and INFO records are dropped
+QUEUE_LENGTH = 10000
+# Records after which the writer is woken up, and the seconds DEBUG and INFO
+# records wait at most
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.5
+# Records written before the writer lets the other threads run
+# and the pause in seconds, rounded down to a plain yield on Windows
+YIELD_EVERY = 10
+YIELD_PAUSE = 0.0005
+# Bytes compressed at a time and the pause in seconds between them
+COMPRESS_CHUNK = 16384
+COMPRESS_PAUSE = 0.002
+# Seconds until rotating is tried again when the log could not be renamed
+ROTATE_RETRY = 10
+
+DROPPED = WpkgMetrics.METRICS.counter("wpkggp_log_dropped_total")
+
+
+class WpkgLogCompressor(object):
+    # Compresses rotated logs on a thread of its own, a few kilobytes at a
+    # time so the threads logging are not kept waiting for the GIL
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.pending = collections.deque()
+        self.wakeup = threading.Event()
+        self.closing = False
+        self.stopping = False
+        self.thread = None
+
+    def add(self, path):
+        self.pending.append(path)
+        if self.thread == None:
+            self.thread = threading.Thread(target=self.run, name="WpkgLogCompressor")
+            self.thread.daemon = True
+            self.thread.start()
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending and not self.stopping:
+                self.compress(self.pending.popleft())
+            self.log_file.enforce_budget()
+            if self.stopping or (self.closing and not self.pending):
+                return
+
+    def compress(self, path):
+        # Written under a temporary name, WpkgLogReader reads the plain log
+        # until the compressed one is complete
+        archive = path + ".gz"
+        temp = archive + ".tmp"
+        try:
+            # Compressed before, but the plain log was being read
+            if not os.path.exists(archive):
+                with open(path, "rb") as src:
+                    dst = gzip.open(temp, "wb")
+                    try:
+                        data = src.read(COMPRESS_CHUNK)
+                        while data and not self.stopping:
+                            dst.write(data)
+                            time.sleep(COMPRESS_PAUSE)
+                            data = src.read(COMPRESS_CHUNK)
+                    finally:
+                        dst.close()
+                if data:
+                    # Stopped halfway, compressed again when the service starts
+                    os.remove(temp)
+                    return
+                os.rename(temp, archive)
+            os.remove(path)
+        except (IOError, OSError), e:
+            sys.stderr.write("Unable to compress %s: %s\n" % (path, e))
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+
+    def close(self, timeout=10):
+        # Waits up to timeout seconds for the logs still to be compressed
+        if self.thread == None:
+            return
+        self.closing = True
+        self.wakeup.set()
+        self.thread.join(timeout)
+        self.stopping = True
+        self.thread.join(1)
+
+
+class WpkgLogFile(logging.Handler):
+    # A log file renamed and replaced by a new one at max_bytes, keeping at
+    # most total_bytes of logs. Written by one thread only, the renamed logs
+    # are compressed by a WpkgLogCompressor.
+    def __init__(self, path, max_bytes=1048576, total_bytes=20971520):
+        logging.Handler.__init__(self)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.total_bytes = total_bytes
+        self.stream = open(path, "ab")
+        self.stream.seek(0, 2)
+        self.size = self.stream.tell()
+        # Time until which rotating is not tried again after it failed
+        self.retry_at = 0
+        self.compressor = WpkgLogCompressor(self)
+        # Left over when the service stopped while compressing
+        for archive in self.get_archives():
+            if not archive.endswith(".gz"):
+                self.compressor.add(archive)
+
+    def get_archives(self):
+        # The rotated logs, oldest first, compressed or still waiting for it
+        base, ext = os.path.splitext(self.path)
+        archives = glob.glob("%s-*%s" % (base, ext)) + glob.glob("%s-*%s.gz" % (base, ext))
+        return sorted(archives, key=lambda path: (os.path.getmtime(path), path))
+
+    def emit(self, record):
+        try:
+            data = self.format(record)
+            if isinstance(data, unicode):
+                data = data.encode("utf-8")
+            data = data + "\n"
+            if self.max_bytes > 0 and self.size > 0 and self.size + len(data) > self.max_bytes:
+                self.rotate()
+            self.stream.write(data)
+            self.size = self.size + len(data)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        if self.stream != None:
+            self.stream.flush()
+
+    def rotate(self):
+        if time.time() < self.retry_at:
+            return
+        base, ext = os.path.splitext(self.path)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        archive = "%s-%s%s" % (base, stamp, ext)
+        i = 1
+        while os.path.exists(archive) or os.path.exists(archive + ".gz"):
+            i = i + 1
+            archive = "%s-%s-%i%s" % (base, stamp, i, ext)
+        self.stream.close()
+        try:
+            os.rename(self.path, archive)
+        except OSError, e:
+            # Opened by WpkgLogReader at the moment, the log grows past
+            # max_bytes until the next try
+            sys.stderr.write("Unable to rotate %s: %s\n" % (self.path, e))
+            self.stream = open(self.path, "ab")
+            self.size = self.stream.tell()
+            self.retry_at = time.time() + ROTATE_RETRY
+            return
+        self.stream = open(self.path, "wb")
+        self.size = 0
+        self.compressor.add(archive)
+
+    def enforce_budget(self):
+        if self.total_bytes <= 0:
+            return
+        archives = []
+        for path in self.get_archives():
+            try:
+                archives.append((path, os.path.getsize(path)))
+            except OSError:
+                # Compressed meanwhile
+                pass
+        total = self.size + sum([size for path, size in archives])
+        for path, size in archives:
+            if total <= self.total_bytes:
+                break
+            try:
+                os.remove(path)
+                total = total - size
+            except OSError:
+                pass
+
+    def close(self):
+        self.compressor.close()
+        if self.stream != None:
+            self.stream.close()
+            self.stream = None
+        logging.Handler.close(self)
+
+
+class WpkgQueueHandler(logging.Handler):
+    # Hands the records to target on a background thread. WARNING and
+    # above are never dropped, the others are when the queue is full.
+    def __init__(self, target, queue_length=QUEUE_LENGTH):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.queue_length = queue_length
+        # Appending to a deque needs no lock, the writer is woken up for
+        # warnings and full batches, otherwise it writes every FLUSH_INTERVAL
+        self.records = collections.deque()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.exception_formatter = logging.Formatter()
+        WpkgMetrics.METRICS.gauge("wpkggp_log_queue_depth", lambda: len(self.records))
+        self.thread = threading.Thread(target=self.run, name="WpkgLogWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def prepare(self, record):
+        # The message and the traceback are resolved by the logging thread,
+        # the arguments might have changed until the record is written
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def handle(self, record):
+        # Without the handler lock, emit only appends to the deque
+        if not self.filter(record):
+            return 0
+        self.emit(record)
+        return 1
+
+    def emit(self, record):
+        try:
+            record = self.prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+        if record.levelno < logging.WARNING and len(self.records) >= self.queue_length:
+            DROPPED.inc()
+            return
+        self.records.append(record)
+        if (record.levelno >= logging.WARNING or len(self.records) >= BATCH_SIZE) and not self.wakeup.is_set():
+            self.wakeup.set()
+
+    def write(self):
+        # Everything queued meanwhile is written in one go, giving up the
+        # GIL every few records so the threads logging are not held up
+        self.target.acquire()
+        try:
+            written = 0
+            while self.records:
+                record = self.records.popleft()
+                if self.target.filter(record):
+                    self.target.emit(record)
+                written = written + 1
+                if written % YIELD_EVERY == 0:
+                    time.sleep(YIELD_PAUSE)
+            self.target.flush()
+        finally:
+            self.target.release()
+
+    def run(self):
+        while not self.stopping:
+            self.wakeup.wait(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.write()
+
+    def close(self):
+        # Writes the queued records and closes the log
+        self.stopping = True
+        self.wakeup.set()
+        self.thread.join(10)
+        self.write()
+        self.target.close()
+        logging.Handler.close(self)
+
+
+if __name__=='__main__':
+    # Compares the time a thread spends logging with the handler used before
+    import tempfile, logging.handlers
+    n = len(sys.argv) > 1 and int(sys.argv[1]) or 50000
+    directory = tempfile.mkdtemp()
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    for name, handler in (
+            ("RotatingFileHandler", logging.handlers.RotatingFileHandler(
+                os.path.join(directory, "rotating.log"), maxBytes=200000, backupCount=2)),
+            ("WpkgQueueHandler", WpkgQueueHandler(WpkgLogFile(
+                os.path.join(directory, "WpkgService.log"), 200000, 2000000)))):
+        (getattr(handler, "target", None) or handler).setFormatter(formatter)
+        logger = logging.getLogger("bench." + name)
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        started = time.time()
+        longest = 0
+        slow = 0
+        for i in range(n):
+            before = time.time()
+            logger.debug("Writing '%s' to pipe", "100 Wpkg-GP is verifying 'package %i' (%i/%i)" % (i, i, n))
+            took = time.time() - before
+            longest = max(longest, took)
+            if took > 0.001:
+                slow = slow + 1
+        logged = time.time() - started
+        handler.close()
+        print "%-20s %6.1f us per record in the logging thread, %4i over 1 ms, longest %6.1f ms, %6.1f us until written" % (
+            name, logged * 1e6 / n, slow, longest * 1000, (time.time() - started) * 1e6 / n)
+    print "Files: %s" % ", ".join(sorted(os.listdir(directory)))
+    shutil.rmtree(directory)
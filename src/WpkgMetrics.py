@@ -0,0 +1,181 @@
+"""WpkgMetrics.py
+Counters, gauges and histograms of the service, sent by the Stats command
+
+The metrics are kept in memory by the module level registry METRICS and
+written in the Prometheus text format, one line per message:
+
+    # TYPE wpkggp_pipe_commands_total counter
+    wpkggp_pipe_commands_total{command="Query"} 12
+    wpkggp_auth_seconds_bucket{le="0.005"} 40
+"""
+import time
+import bisect
+import threading
+import contextlib
+
+# Upper bounds of the histogram buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def format_labels(labels, extra=None):
+    items = sorted(labels.items())
+    if extra != None:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{%s}" % ",".join(['%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                              for k, v in items])
+
+
+def format_value(value):
+    if isinstance(value, float) and value != int(value):
+        return "%.6g" % value
+    return "%i" % value
+
+
+class WpkgCounter(object):
+    type = "counter"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value = self.value + amount
+
+    def samples(self, name, labels):
+        return [(name + format_labels(labels), self.value)]
+
+
+class WpkgGauge(object):
+    # Either set by the code, or read from fn when the metrics are collected
+    type = "gauge"
+
+    def __init__(self, fn=None):
+        self.lock = threading.Lock()
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value = self.value + amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def samples(self, name, labels):
+        value = self.value
+        if self.fn != None:
+            try:
+                value = self.fn()
+            except Exception:
+                return []
+        return [(name + format_labels(labels), value)]
+
+
+class WpkgHistogram(object):
+    type = "histogram"
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1) # The last one counts values above all buckets
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] = self.counts[i] + 1
+            self.sum = self.sum + value
+            self.count = self.count + 1
+
+    @contextlib.contextmanager
+    def time(self):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - started)
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        samples = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative = cumulative + n
+            samples.append((name + "_bucket" + format_labels(labels, ("le", bound)), cumulative))
+        samples.append((name + "_bucket" + format_labels(labels, ("le", "+Inf")), count))
+        samples.append((name + "_sum" + format_labels(labels), total))
+        samples.append((name + "_count" + format_labels(labels), count))
+        return samples
+
+
+class WpkgMetrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {} # (name, labels) -> metric
+        self.names = [] # [(name, type)] in the order they were created
+
+    def get(self, cls, name, labels, *args):
+        # Returns the metric of name and labels, created on first use
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric != None:
+            return metric
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric == None:
+                metric = self.metrics[key] = cls(*args)
+                if (name, cls.type) not in self.names:
+                    self.names.append((name, cls.type))
+            return metric
+
+    def counter(self, name, **labels):
+        return self.get(WpkgCounter, name, labels)
+
+    def gauge(self, name, fn=None, **labels):
+        return self.get(WpkgGauge, name, labels, fn)
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS, **labels):
+        return self.get(WpkgHistogram, name, labels, buckets)
+
+    def collect(self):
+        # Returns the lines of the text format, grouped by metric name
+        with self.lock:
+            names = list(self.names)
+            metrics = sorted(self.metrics.items())
+        lines = []
+        for name, type in names:
+            lines.append("# TYPE %s %s" % (name, type))
+            for (metric_name, labels), metric in metrics:
+                if metric_name == name:
+                    for sample, value in metric.samples(name, dict(labels)):
+                        lines.append("%s %s" % (sample, format_value(value)))
+        return lines
+
+
+# The registry of the service
+METRICS = WpkgMetrics()
+METRICS.gauge("wpkggp_start_time_seconds").set(int(time.time()))
+
+
+if __name__=='__main__':
+    # Compares the cost of counting with the cost of a bare increment
+    import timeit
+    counter = METRICS.counter("wpkggp_pipe_commands_total", command="Query")
+    histogram = METRICS.histogram("wpkggp_auth_seconds")
+    n = 100000
+    print "counter.inc()       %6.2f us" % (timeit.timeit(counter.inc, number=n) * 1e6 / n)
+    print "histogram.observe() %6.2f us" % (timeit.timeit(lambda: histogram.observe(0.003), number=n) * 1e6 / n)
+    started = time.time()
+    lines = METRICS.collect()
+    print "collect()           %6.2f us for %i lines" % ((time.time() - started) * 1e6, len(lines))
+    print "\n".join(lines)
@@ -0,0 +1,133 @@
+"""WpkgMirrors.py
+Chooses the fastest of several copies of the wpkg share
+
+WpkgMirrors lists copies of the share holding wpkg.js, e.g. a replica in
+every branch office. Every mirror is measured by the time to connect to
+its server and the speed of reading wpkg.js from it. The ranking is kept
+for a while, and commands and paths pointing at the share in WpkgCommand
+are rewritten to the best mirror that works.
+"""
+import os
+import re
+import time
+import logging
+import threading
+import WpkgProbe
+
+# Bytes read from wpkg.js to measure the throughput of a mirror
+SAMPLE_SIZE = 262144
+# Used for the ranking as long as the throughput of a mirror is unknown
+DEFAULT_THROUGHPUT = 1048576.0
+# A task reads at least this much from the share, used to weigh latency
+# against throughput
+REFERENCE_BYTES = 1048576
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+def get_share(path):
+    # \\server\share\some\path -> \\server\share, None if path is no UNC path
+    result = re.match(r'(\\\\[^\\]+\\[^\\]+)', path)
+    if result == None:
+        return None
+    return result.group(1)
+
+
+def parse_mirrors(value):
+    if not value:
+        return []
+    return [m.rstrip("\\") for m in re.split(r"[,;]+", value) if m.strip()]
+
+
+class WpkgMirror(object):
+    def __init__(self, root):
+        self.root = root.strip().rstrip("\\")
+        self.share = get_share(self.root)
+        self.host = self.share and self.share[2:].split("\\", 1)[0]
+        self.latency = None
+        self.throughput = None
+        self.down = False
+
+    def cost(self):
+        # Estimated seconds to read REFERENCE_BYTES
+        if self.down or self.latency == None:
+            return None
+        return self.latency + REFERENCE_BYTES / (self.throughput or DEFAULT_THROUGHPUT)
+
+
+class WpkgMirrors(object):
+    def __init__(self, primary, mirrors, wpkg_file, ttl=3600, port=445):
+        # primary is the share in WpkgCommand, wpkg_file the path of
+        # wpkg.js relative to it
+        self.primary = primary.rstrip("\\")
+        self.wpkg_file = wpkg_file.lstrip("\\")
+        self.mirrors = [WpkgMirror(self.primary)] + \
+                       [WpkgMirror(m) for m in mirrors if m.lower() != self.primary.lower()]
+        self.ttl = ttl
+        self.port = port
+        self.lock = threading.Lock()
+        self.ranked = None
+        self.ranked_time = 0
+
+    def measure(self, mirror):
+        mirror.latency = None
+        if mirror.host == None:
+            return
+        started = time.time()
+        probe = WpkgProbe.WpkgProbe([(mirror.host, self.port)])
+        if probe.probe(2) == None:
+            logger.info("Mirror %s is not reachable" % mirror.root)
+            return
+        mirror.latency = time.time() - started
+        # Reading only works if the service may already access the mirror
+        started = time.time()
+        try:
+            with open(os.path.join(mirror.root, self.wpkg_file), "rb") as f:
+                size = len(f.read(SAMPLE_SIZE))
+            mirror.throughput = size / max(time.time() - started, 0.001)
+        except IOError:
+            pass
+        logger.debug("Mirror %s: connect %.1f ms, read %s" % (mirror.root, mirror.latency * 1000,
+                     mirror.throughput and "%.0f KB/s" % (mirror.throughput / 1024) or "unknown"))
+
+    def rank(self):
+        # Returns the mirrors that are up, best first. Measures them again
+        # once the ranking is older than ttl seconds.
+        with self.lock:
+            if self.ranked == None or time.time() - self.ranked_time >= self.ttl:
+                threads = []
+                for mirror in self.mirrors:
+                    mirror.down = False
+                    t = threading.Thread(target=self.measure, args=(mirror,))
+                    t.daemon = True
+                    t.start()
+                    threads.append(t)
+                for t in threads:
+                    t.join(10)
+                self.ranked_time = time.time()
+                self.ranked = sorted([m for m in self.mirrors if m.cost() != None], key=lambda m: m.cost())
+                logger.info("Mirror ranking: %s" % ", ".join([m.root for m in self.ranked]))
+            return [m for m in self.ranked if not m.down]
+
+    def mark_down(self, mirror):
+        logger.info("Mirror %s dropped out" % mirror.root)
+        mirror.down = True
+
+    def is_healthy(self, mirror):
+        try:
+            return os.path.isfile(os.path.join(mirror.root, self.wpkg_file))
+        except (IOError, OSError):
+            return False
+
+    def rewrite(self, text, mirror):
+        # Points every path below the primary share to the mirror
+        if text == None or mirror == None or mirror.root.lower() == self.primary.lower():
+            return text
+        return re.sub(re.escape(self.primary) + r"(?=\\|\"|\s|$)", lambda m: mirror.root, text, flags=re.IGNORECASE)
+
+h = NullHandler()
+logger = logging.getLogger("WpkgService")
+logger.addHandler(h)
@@ -1,85 +1,252 @@
-# -*- encoding: utf-8 -*-
-import re
-
-class WpkgOutputParser(object):
-    def __init__(self, codepage):
-        self.reset()
-        self.codepage = codepage
-        
-    def reset(self):
-        self.operation = "Initializing Wpkg-GP"
-        self.package_name = ""
-        self.pkgnum = 0
-        self.pkgtot = 0
-        self.updated = True
-        self.started = False
-        
-    def parse_line(self, line_to_parse):
-        #Remove all strings not showing "YYYY-MM-DD hh:mm:ss, STATUS  : "
-        if not re.search("[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}, STATUS  : ", line_to_parse):
-            self.updated = False
-            return
-        
-        previous_operation = self.operation
-        previous_package_name = self.package_name
-        previous_pkgnum = self.pkgnum
-        
-        #Remove "STATUS"-part:
-        line = ":".join(line_to_parse.split(":")[3:])[1:]
-        
-        #Checking current operation:
-        if re.match("^Remove: Checking status", line):
-            #No action is being performed, only updating internal percentage counter, but do not generate output
-            self.operation = _("removing")
-            self.package_name, self.pkgnum, self.pkgtot = re.search("('.*') \(([0-9]+)/([0-9]+)\)$", line).group(1, 2, 3)
-        elif re.match("^Remove: Removing package", line):
-            self.operation = _("removing")
-            self.package_name, self.pkgnum, self.pkgtot = re.search("('.*') \(([0-9]+)/([0-9]+)\)$", line).group(1, 2, 3)
-        elif re.match("^Install:", line):
-            #No action is being performed, only updating internal percentage counter, but do not generate output
-            self.operation = _("verifying")
-            self.package_name, self.pkgnum, self.pkgtot = re.search("('.*') \(([0-9]+)/([0-9]+)\)$", line).group(1, 2, 3)
-        elif re.match("^Performing operation", line):
-            #Operation is actually being performed
-            operation, self.package_name = re.search(
-                "^Performing operation \((.+)\) on ('.+')", line).group(1,2)
-            #The description of the operation is misleading on this message, except for upgrades
-            if operation == "upgrade":
-                self.operation = _("upgrading")
-            elif operation == "install":
-                self.operation = _("installing")
-        if self.pkgnum == previous_pkgnum and self.package_name == previous_package_name and self.operation == previous_operation:
-            self.updated = False
-        else:
-            self.updated = True
-
-    def get_formatted_line(self):
-        if self.updated == True:
-            # Example: Wpkg-GP is installing Skype (1/25)
-            return _("Wpkg-GP is %s %s (%s/%s)") % (self.operation, self.package_name.decode(self.codepage).encode('utf-8'), self.pkgnum, self.pkgtot)
-        else:
-            return False
-
-def main():
-    example = """
-2011-05-07 10:41:30, STATUS  : Starting software synchronization
-2011-05-07 10:41:30, STATUS  : Number of packages to be removed: 2
-2011-05-07 10:41:30, STATUS  : Remove: Checking status of 'Removeme' (1/2)
-2011-05-07 10:41:30, STATUS  : Performing operation (install) on 'Removeme' (removeme)
-2011-05-07 10:41:30, STATUS  : Remove: Removing package 'Removeme' (1/2)
-2011-05-07 10:41:30, STATUS  : Install: Verifying package 'test' (1/2)
-2011-05-07 10:41:30, STATUS  : Performing operation (install) on 'test' (rebootnow)
-2011-05-07 10:41:30, STATUS  : Install: Verifying package 'donothing' (2/2)
-2011-05-07 10:41:30, STATUS  : Performing operation (upgrade) on 'donothing' (donothing)
-2011-05-07 10:41:30, STATUS  : Finished software synchronization"""
-    parser = WpkgOutputParser('cp850') # TEST
-    for line in example.split("\n"):
-        parser.parse_line(line)
-        if parser.updated == True:
-            print parser.get_formatted_line()
-        
-
-if __name__=='__main__':
-    import gettext
-    gettext.install('wpkg-gp')
-    main()
+# -*- encoding: utf-8 -*-
+import re
+import collections
+
+# A status update of wpkg.js, phase is one of "removing", "verifying",
+# "installing" or "upgrading"
+WpkgStatusEvent = collections.namedtuple("WpkgStatusEvent", "phase package index total")
+
+# One pattern for every status line wpkg.js writes, the named groups tell
+# which kind of line it is
+STATUS_LINE = re.compile(
+    r"[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}, STATUS  : (?:"
+    r"(?:(?P<remove>Remove: (?:Checking status|Removing package))|(?P<verify>Install:))"
+    r".*?(?P<name>'.*') \((?P<index>[0-9]+)/(?P<total>[0-9]+)\)$"
+    r"|Performing operation \((?P<operation>.+)\) on (?P<opname>'.+')"
+    r")?")
+
+class WpkgOutputParser(object):
+    def __init__(self, codepage):
+        self.codepage = codepage
+        self.names = {} # Package names as written by wpkg.js -> utf-8
+        self.reset()
+        
+    def reset(self):
+        self.operation = "Initializing Wpkg-GP"
+        self.phase = None
+        self.package_name = ""
+        self.pkgnum = 0
+        self.pkgtot = 0
+        self.updated = True
+        self.started = False
+        
+    def parse_line(self, line_to_parse):
+        # Returns a WpkgStatusEvent for lines about a package, otherwise None
+        match = STATUS_LINE.match(line_to_parse)
+        if match == None:
+            #Not a line showing "YYYY-MM-DD hh:mm:ss, STATUS  : "
+            self.updated = False
+            return None
+        remove, verify, name, index, total, operation, opname = match.groups()
+        if name != None:
+            if remove != None:
+                #Checking status only updates the internal percentage counter
+                phase, self.operation = "removing", _("removing")
+            else:
+                #No action is being performed, only updating internal percentage counter
+                phase, self.operation = "verifying", _("verifying")
+        elif opname != None:
+            #Operation is actually being performed
+            name = opname
+            index, total = self.pkgnum, self.pkgtot
+            #The description of the operation is misleading on this message, except for upgrades
+            if operation == "upgrade":
+                phase, self.operation = "upgrading", _("upgrading")
+            elif operation == "install":
+                phase, self.operation = "installing", _("installing")
+            else:
+                phase = self.phase
+        else:
+            self.updated = False
+            return None
+        self.updated = phase != self.phase or name != self.package_name or index != self.pkgnum
+        self.phase = phase
+        self.package_name, self.pkgnum, self.pkgtot = name, index, total
+        return WpkgStatusEvent(phase, self.get_package_name(name), int(index), int(total))
+
+    def get_package_name(self, name):
+        # wpkg.js writes every package several times, each name is decoded once
+        try:
+            return self.names[name]
+        except KeyError:
+            decoded = self.names[name] = name[1:-1].decode(self.codepage, "replace").encode("utf-8")
+            return decoded
+
+    def get_formatted_line(self):
+        if self.updated == True:
+            # Example: Wpkg-GP is installing 'Skype' (1/25)
+            return _("Wpkg-GP is %s %s (%s/%s)") % (self.operation, "'%s'" % self.get_package_name(self.package_name),
+                                                    self.pkgnum, self.pkgtot)
+        else:
+            return False
+
+class WpkgQueryParser(object):
+    # Parses the output of wpkg.js /query one line at a time. A package is
+    # reported as soon as its Action line has been read.
+    actions = {'Installation pending':'install',
+               'Upgrade pending':'update',
+               'Downgrade pending': 'downgrade',
+               'Remove pending': 'remove'}
+    excludes = ('ID:', 'Reboot:', 'Execute:', 'Priority:', 'Status:', 'Revision (old):')
+    spaces = re.compile('\s{2,}')
+
+    def __init__(self, codepage):
+        self.codepage = codepage
+        self.reset()
+
+    def reset(self):
+        self.header = 4 # Leading lines written by cscript and wpkg.js
+        self.name = None
+        self.revision = None
+        self.count = 0
+
+    def parse_line(self, line):
+        # Returns (task, name, revision) when a package is complete
+        if self.header > 0:
+            self.header = self.header - 1
+            return None
+        # Remove leading spaces and double spaces
+        line = self.spaces.sub('', line.rstrip("\r\n").lstrip())
+        if line == '' or line.startswith(self.excludes):
+            return None
+        elif line.startswith('Revision:'):
+            self.revision = line.replace('Revision:', '')
+        elif line.startswith('Revision (new):'):
+            self.revision = line.replace('Revision (new):', '')
+        elif line.startswith('Action:'):
+            action = line.replace('Action:', '')
+            if self.name == None:
+                return None
+            record = (self.actions.get(action, action), self.name, self.revision)
+            self.name = None
+            self.revision = None
+            self.count = self.count + 1
+            return record
+        else:
+            # Package Name
+            self.name = line.decode(self.codepage).encode('utf-8')
+            self.revision = None
+        return None
+
+class LegacyOutputParser(object):
+    # The parser used before, kept for the benchmark
+    def __init__(self, codepage):
+        self.reset()
+        self.codepage = codepage
+        
+    def reset(self):
+        self.operation = "Initializing Wpkg-GP"
+        self.package_name = ""
+        self.pkgnum = 0
+        self.pkgtot = 0
+        self.updated = True
+        self.started = False
+        
+    def parse_line(self, line_to_parse):
+        #Remove all strings not showing "YYYY-MM-DD hh:mm:ss, STATUS  : "
+        if not re.search("[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}, STATUS  : ", line_to_parse):
+            self.updated = False
+            return
+        
+        previous_operation = self.operation
+        previous_package_name = self.package_name
+        previous_pkgnum = self.pkgnum
+        
+        #Remove "STATUS"-part:
+        line = ":".join(line_to_parse.split(":")[3:])[1:]
+        
+        #Checking current operation:
+        if re.match("^Remove: Checking status", line):
+            #No action is being performed, only updating internal percentage counter, but do not generate output
+            self.operation = _("removing")
+            self.package_name, self.pkgnum, self.pkgtot = re.search("('.*') \(([0-9]+)/([0-9]+)\)$", line).group(1, 2, 3)
+        elif re.match("^Remove: Removing package", line):
+            self.operation = _("removing")
+            self.package_name, self.pkgnum, self.pkgtot = re.search("('.*') \(([0-9]+)/([0-9]+)\)$", line).group(1, 2, 3)
+        elif re.match("^Install:", line):
+            #No action is being performed, only updating internal percentage counter, but do not generate output
+            self.operation = _("verifying")
+            self.package_name, self.pkgnum, self.pkgtot = re.search("('.*') \(([0-9]+)/([0-9]+)\)$", line).group(1, 2, 3)
+        elif re.match("^Performing operation", line):
+            #Operation is actually being performed
+            operation, self.package_name = re.search(
+                "^Performing operation \((.+)\) on ('.+')", line).group(1,2)
+            #The description of the operation is misleading on this message, except for upgrades
+            if operation == "upgrade":
+                self.operation = _("upgrading")
+            elif operation == "install":
+                self.operation = _("installing")
+        if self.pkgnum == previous_pkgnum and self.package_name == previous_package_name and self.operation == previous_operation:
+            self.updated = False
+        else:
+            self.updated = True
+
+    def get_formatted_line(self):
+        if self.updated == True:
+            # Example: Wpkg-GP is installing Skype (1/25)
+            return _("Wpkg-GP is %s %s (%s/%s)") % (self.operation, self.package_name.decode(self.codepage).encode('utf-8'), self.pkgnum, self.pkgtot)
+        else:
+            return False
+
+def main():
+    example = """
+2011-05-07 10:41:30, STATUS  : Starting software synchronization
+2011-05-07 10:41:30, STATUS  : Number of packages to be removed: 2
+2011-05-07 10:41:30, STATUS  : Remove: Checking status of 'Removeme' (1/2)
+2011-05-07 10:41:30, STATUS  : Performing operation (install) on 'Removeme' (removeme)
+2011-05-07 10:41:30, STATUS  : Remove: Removing package 'Removeme' (1/2)
+2011-05-07 10:41:30, STATUS  : Install: Verifying package 'test' (1/2)
+2011-05-07 10:41:30, STATUS  : Performing operation (install) on 'test' (rebootnow)
+2011-05-07 10:41:30, STATUS  : Install: Verifying package 'donothing' (2/2)
+2011-05-07 10:41:30, STATUS  : Performing operation (upgrade) on 'donothing' (donothing)
+2011-05-07 10:41:30, STATUS  : Finished software synchronization"""
+    parser = WpkgOutputParser('cp850') # TEST
+    for line in example.split("\n"):
+        parser.parse_line(line)
+        if parser.updated == True:
+            print parser.get_formatted_line()
+        
+
+def generate_log(packages=2000):
+    # A log like wpkg.js /debug writes it, with many debug lines per package
+    lines = []
+    for i in range(packages):
+        name = "'Package %i'" % i
+        lines.append("2011-05-07 10:41:30, STATUS  : Install: Verifying package %s (%i/%i)\n" % (name, i + 1, packages))
+        for j in range(20):
+            lines.append("2011-05-07 10:41:30, DEBUG   : Checking existence of registry path 'HKLM\\Software\\Vendor%i\\Key%i': true\n" % (i, j))
+        lines.append("2011-05-07 10:41:30, STATUS  : Performing operation (install) on %s (package%i)\n" % (name, i))
+        lines.append("2011-05-07 10:41:31, DEBUG   : Command 'msiexec /qn /i package%i.msi' returned exit code [0].\n" % i)
+    return lines
+
+
+def benchmark(path=None):
+    # Parses a recorded log, or a generated one, with the old and the new parser
+    import time
+    if path != None:
+        with open(path, "rb") as f:
+            lines = [line.rstrip("\r\n") + "\n" for line in f]
+    else:
+        lines = generate_log()
+    size = sum([len(line) for line in lines])
+    print "%i lines, %.1f MB" % (len(lines), size / 1048576.0)
+    for parser in (LegacyOutputParser('cp850'), WpkgOutputParser('cp850')):
+        started = time.time()
+        for line in lines:
+            try:
+                parser.parse_line(line)
+            except AttributeError:
+                pass # The old parser fails on some Install: lines
+            if parser.updated:
+                parser.get_formatted_line()
+        elapsed = time.time() - started
+        print "%-20s %10.0f lines/s" % (parser.__class__.__name__, len(lines) / elapsed)
+
+
+if __name__=='__main__':
+    import sys, gettext
+    gettext.install('wpkg-gp')
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark(len(sys.argv) > 2 and sys.argv[2] or None)
+    else:
+        main()
@@ -0,0 +1,181 @@
+"""WpkgOutputPump.py
+Event driven reading of the output of a running process
+"""
+import os
+import time
+import threading
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty  # python 3.x
+
+EOF = object()
+EXITED = object()
+
+
+class WpkgOutputPump(object):
+    # Reads the output of a process in chunks on a separate thread and hands
+    # out complete lines as soon as they arrive. The consumer blocks until
+    # there is something to do, instead of polling the process.
+    def __init__(self, proc, chunk_size=4096, grace=2):
+        self.proc = proc
+        self.chunk_size = chunk_size
+        # Seconds to wait for output after the process has exited, in case
+        # a child process still holds the pipe open
+        self.grace = grace
+        self.queue = Queue()
+        self.bytes_read = 0
+        reader = threading.Thread(target=self.read)
+        reader.daemon = True
+        reader.start()
+        waiter = threading.Thread(target=self.wait)
+        waiter.daemon = True
+        waiter.start()
+
+    def read(self):
+        fd = self.proc.stdout.fileno()
+        pending = ""
+        try:
+            while 1:
+                data = os.read(fd, self.chunk_size)
+                if not data:
+                    break
+                self.bytes_read = self.bytes_read + len(data)
+                lines = (pending + data).split("\n")
+                pending = lines.pop()
+                for line in lines:
+                    self.queue.put(line.rstrip("\r") + "\n")
+        except (OSError, IOError):
+            pass
+        if pending:
+            self.queue.put(pending.rstrip("\r"))
+        self.queue.put(EOF)
+
+    def wait(self):
+        self.proc.wait()
+        self.queue.put(EXITED)
+
+    def lines(self):
+        # Yields lines until the output is closed
+        exited = False
+        while 1:
+            if exited:
+                try:
+                    item = self.queue.get(timeout=self.grace)
+                except Empty:
+                    return
+            else:
+                item = self.queue.get()
+            if item is EOF:
+                return
+            elif item is EXITED:
+                exited = True
+            else:
+                yield item
+
+
+class WpkgTicker(object):
+    # Calls callback every interval seconds until stopped
+    def __init__(self, interval, callback):
+        self.interval = interval
+        self.callback = callback
+        self.stopped = threading.Event()
+        self.ticks = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.ticks = self.ticks + 1
+            self.callback()
+
+    def stop(self, timeout=5):
+        # Waits for a callback still running, so nothing it writes comes
+        # after what the caller writes next
+        self.stopped.set()
+        if threading.current_thread() != self.thread:
+            self.thread.join(timeout)
+
+
+FAKE_CSCRIPT = r"""
+import sys, time
+lines, interval = int(sys.argv[1]), float(sys.argv[2])
+for i in range(lines):
+    sys.stdout.write("%s, STATUS  : Install: Verifying package 'package%i' (%i/%i) @%r\n" %
+                     (time.strftime("%Y-%m-%d %H:%M:%S"), i, i + 1, lines, time.time()))
+    sys.stdout.flush()
+    time.sleep(interval)
+"""
+
+
+def legacy_pump(proc, counters):
+    # The polling loop WpkgExecuter.Execute used before
+    def enqueue_output(out, queue):
+        for line in iter(out.readline, ''):
+            queue.put(line)
+        out.close()
+    q = Queue()
+    t = threading.Thread(target=enqueue_output, args=(proc.stdout, q))
+    t.daemon = True
+    t.start()
+    quit = False
+    while 1:
+        counters["wakeups"] = counters["wakeups"] + 1
+        try:
+            line = q.get(timeout=0.05)
+        except Empty:
+            if quit:
+                break
+        else:
+            yield line
+            if quit:
+                break
+        if proc.poll() != None:
+            quit = True
+
+
+def benchmark(lines=50, interval=0.2):
+    # Runs a fake cscript printing status lines, once through the old polling
+    # loop and once through the pump, and compares latency and wakeups
+    import sys, subprocess
+    command = [sys.executable, "-c", FAKE_CSCRIPT, str(lines), str(interval)]
+    for name in ("polling", "pump"):
+        counters = {"wakeups": 0}
+        latencies = []
+        cpu = os.times()
+        started = time.time()
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE)
+        if name == "polling":
+            source = legacy_pump(proc, counters)
+            ticker = None
+        else:
+            pump = WpkgOutputPump(proc)
+            source = pump.lines()
+            ticker = WpkgTicker(1, lambda: None)
+        for line in source:
+            if name == "pump":
+                counters["wakeups"] = counters["wakeups"] + 1
+            latencies.append(time.time() - float(line.rsplit("@", 1)[1]))
+        proc.wait()
+        if ticker != None:
+            ticker.stop()
+            counters["wakeups"] = counters["wakeups"] + ticker.ticks
+        elapsed = time.time() - started
+        cpu = sum(os.times()[0:2]) - sum(cpu[0:2])
+        latencies.sort()
+        print "%s:" % name
+        print "  lines..........: %i" % len(latencies)
+        print "  wakeups/s......: %.1f" % (counters["wakeups"] / elapsed)
+        print "  cpu seconds....: %.3f" % cpu
+        print "  latency mean...: %.2f ms" % (sum(latencies) / len(latencies) * 1000)
+        print "  latency max....: %.2f ms" % (latencies[-1] * 1000)
+
+
+if __name__=='__main__':
+    import sys
+    if len(sys.argv) > 2:
+        benchmark(int(sys.argv[1]), float(sys.argv[2]))
+    else:
+        benchmark()
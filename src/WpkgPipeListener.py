@@ -0,0 +1,170 @@
+"""WpkgPipeListener.py
+Keeps a backlog of named pipe instances waiting for clients
+"""
+import pywintypes, winerror
+from win32event import *
+from win32file import *
+from win32pipe import *
+import logging
+import time
+
+# Milliseconds between attempts to put a failed pipe instance back in place
+RETRY_INTERVAL = 5000
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+class WpkgPipeInstance(object):
+    def __init__(self, pipe_name, security):
+        self.pipe_name = pipe_name
+        self.security = security
+        self.overlapped = pywintypes.OVERLAPPED()
+        self.overlapped.hEvent = CreateEvent(None, 0, 0, None)
+        self.handle = None
+
+    def listen(self):
+        self.handle = CreateNamedPipe(self.pipe_name,
+                PIPE_ACCESS_DUPLEX| FILE_FLAG_OVERLAPPED,
+                PIPE_TYPE_MESSAGE | PIPE_READMODE_BYTE,
+                PIPE_UNLIMITED_INSTANCES,       # max instances
+                0, 0, 6000,
+                self.security)
+        try:
+            hr = ConnectNamedPipe(self.handle, self.overlapped)
+        except error:
+            CloseHandle(self.handle)
+            self.handle = None
+            raise
+        if hr==winerror.ERROR_PIPE_CONNECTED:
+            # Client is already connected - signal event
+            SetEvent(self.overlapped.hEvent)
+
+    def accept(self):
+        # Hands over the connected handle, the caller is responsible for closing it
+        handle = self.handle
+        self.handle = None
+        return handle
+
+    def close(self):
+        if self.handle != None:
+            try:
+                CloseHandle(self.handle)
+            except error:
+                pass
+            self.handle = None
+
+
+class WpkgPipeListener(object):
+    def __init__(self, pipe_name, security, instances=4):
+        # WaitForMultipleObjects takes at most 64 handles, one is the stop event
+        instances = max(1, min(instances, MAXIMUM_WAIT_OBJECTS - 1))
+        self.instances = [WpkgPipeInstance(pipe_name, security) for i in range(instances)]
+        for instance in self.instances:
+            self.rearm(instance)
+        if not [i for i in self.instances if i.handle != None]:
+            # Not even one instance, the pipe name is most likely taken
+            raise error(winerror.ERROR_PIPE_BUSY, "CreateNamedPipe", "No pipe instance could be created")
+        logger.debug("Listening on %i pipe instances" % len(self.instances))
+
+    def rearm(self, instance):
+        # Returns False if the instance could not listen, it is tried again
+        # by the next wait()
+        try:
+            instance.listen()
+            return True
+        except error, details:
+            logger.error("Error creating pipe instance, retrying in %i seconds: %s" %
+                         (RETRY_INTERVAL / 1000, details))
+            return False
+
+    def wait(self, stop_event):
+        # Returns a connected pipe handle, or None if stop_event was signalled
+        events = [stop_event] + [i.overlapped.hEvent for i in self.instances]
+        while 1:
+            failed = [i for i in self.instances if i.handle == None]
+            for instance in failed:
+                self.rearm(instance)
+            timeout = INFINITE
+            if [i for i in self.instances if i.handle == None]:
+                timeout = RETRY_INTERVAL
+            rc = WaitForMultipleObjects(events, 0, timeout)
+            if rc == WAIT_TIMEOUT:
+                continue
+            if rc==WAIT_OBJECT_0:
+                return None
+            instance = self.instances[rc - WAIT_OBJECT_0 - 1]
+            handle = instance.accept()
+            # Put a fresh instance in place before the client is served. The
+            # client is served even if that fails.
+            self.rearm(instance)
+            return handle
+
+    def close(self):
+        for instance in self.instances:
+            instance.close()
+
+
+def benchmark(server=".", clients=200, message="Ping"):
+    # Connects a burst of clients at once and reports the connect latency
+    import threading
+    latencies = []
+    lock = threading.Lock()
+    start = threading.Event()
+    pipe_name = "\\\\%s\\pipe\\WPKG" % server
+
+    def client():
+        start.wait()
+        t0 = time.time()
+        while 1:
+            try:
+                handle = CreateFile(pipe_name, GENERIC_READ|GENERIC_WRITE, 0, None, OPEN_EXISTING, 0, None)
+                break
+            except pywintypes.error as exc:
+                if exc.winerror != winerror.ERROR_PIPE_BUSY:
+                    raise
+                WaitNamedPipe(pipe_name, 20000)
+        t1 = time.time()
+        with lock:
+            latencies.append(t1 - t0)
+        try:
+            SetNamedPipeHandleState(handle, PIPE_READMODE_MESSAGE, None, None)
+            WriteFile(handle, message)
+            while 1:
+                ReadFile(handle, 512)
+        except pywintypes.error:
+            pass
+        CloseHandle(handle)
+
+    threads = [threading.Thread(target=client) for i in range(clients)]
+    for t in threads:
+        t.start()
+    start.set()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    print "Clients: %i" % len(latencies)
+    print "p50....: %.1f ms" % percentile(0.50)
+    print "p99....: %.1f ms" % percentile(0.99)
+    print "max....: %.1f ms" % (latencies[-1] * 1000)
+
+
+if __name__=='__main__':
+    import sys, getopt
+    server = "."
+    clients = 200
+    opts, args = getopt.getopt(sys.argv[1:], 's:n:')
+    for o,a in opts:
+        if o=='-s':
+            server = a
+        if o=='-n':
+            clients = int(a)
+    benchmark(server, clients)
+else:
+    h = NullHandler()
+    logger = logging.getLogger("WpkgService")
+    logger.addHandler(h)
@@ -0,0 +1,217 @@
+"""WpkgProbe.py
+Finds out if the network is ready by connecting to several hosts at once
+
+All addresses of all configured hosts and ports are tried in parallel,
+happy eyeballs style (RFC 8305): address families are interleaved and a
+new connection attempt is started every ATTEMPT_DELAY seconds without
+waiting for the previous ones. The first connection that succeeds ends
+the probe.
+"""
+import re
+import time
+import errno
+import socket
+import select
+import logging
+import threading
+
+# Seconds between starting two connection attempts
+ATTEMPT_DELAY = 0.25
+# Connecting in progress on a non-blocking socket
+IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035)
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+def parse_targets(hosts, ports):
+    # "server1, server2:139" and "445 139" -> [(host, port), ...]
+    targets = []
+    ports = [int(p) for p in re.split(r"[\s,;]+", str(ports).strip()) if p]
+    for host in re.split(r"[\s,;]+", hosts.strip()):
+        if not host:
+            continue
+        if host.count(":") == 1:
+            host, port = host.split(":")
+            targets.append((host, int(port)))
+        else:
+            targets.extend([(host, port) for port in ports])
+    return targets
+
+
+class WpkgResolver(object):
+    # Caches name lookups. When a lookup fails, e.g. because the DNS server
+    # is not reachable yet, the last answer is used even if it has expired.
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.answers = {} # (host, port) -> (time, [(family, sockaddr), ...])
+
+    def cached(self, host, port):
+        with self.lock:
+            answer = self.answers.get((host, port))
+        if answer != None and time.time() - answer[0] < self.ttl:
+            return answer[1]
+        return None
+
+    def lookup(self, host, port):
+        try:
+            infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        except socket.error, e:
+            logger.debug("Unable to resolve %s: %s" % (host, e))
+            with self.lock:
+                answer = self.answers.get((host, port))
+            if answer != None:
+                return answer[1]
+            return []
+        addresses = []
+        for family, socktype, proto, canonname, sockaddr in infos:
+            if (family, sockaddr) not in addresses:
+                addresses.append((family, sockaddr))
+        with self.lock:
+            self.answers[(host, port)] = (time.time(), addresses)
+        return addresses
+
+    def resolve(self, targets, timeout):
+        # Resolves all targets in parallel, returns the addresses known
+        # after at most timeout seconds
+        results = {}
+        threads = []
+        for target in targets:
+            addresses = self.cached(*target)
+            if addresses != None:
+                results[target] = addresses
+                continue
+            def lookup(target=target):
+                results[target] = self.lookup(*target)
+            t = threading.Thread(target=lookup)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        deadline = time.time() + timeout
+        for t in threads:
+            t.join(max(0, deadline - time.time()))
+        return [(target, results.get(target, [])) for target in targets]
+
+
+def interleave(resolved):
+    # Orders the addresses so that families and hosts alternate, the first
+    # address of every target is tried before the second of any target
+    queues = [[(target, family, sockaddr) for family, sockaddr in addresses] for target, addresses in resolved]
+    ordered = []
+    while any(queues):
+        for family in (socket.AF_INET6, socket.AF_INET):
+            for queue in queues:
+                for i in range(len(queue)):
+                    if queue[i][1] == family:
+                        ordered.append(queue.pop(i))
+                        break
+    return ordered
+
+
+def connect_first(addresses, timeout):
+    # Returns (target, sockaddr) of the first address accepting a
+    # connection within timeout seconds, or None
+    pending = {}
+    deadline = time.time() + timeout
+    next_attempt = time.time()
+    try:
+        while addresses or pending:
+            now = time.time()
+            if now >= deadline:
+                return None
+            if addresses and now >= next_attempt:
+                target, family, sockaddr = addresses.pop(0)
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.setblocking(0)
+                rc = sock.connect_ex(sockaddr)
+                if rc == 0:
+                    sock.close()
+                    return target, sockaddr
+                if rc in IN_PROGRESS:
+                    pending[sock] = (target, sockaddr)
+                else:
+                    sock.close()
+                    # Failed at once, e.g. no route to host, try the next one
+                    next_attempt = now
+                    continue
+                next_attempt = now + ATTEMPT_DELAY
+            if not pending:
+                time.sleep(max(0, min(next_attempt, deadline) - time.time()))
+                continue
+            wait = deadline - now
+            if addresses:
+                wait = min(wait, max(0, next_attempt - now))
+            socks = pending.keys()
+            # Windows reports failed connections as exceptional
+            r, writable, failed = select.select([], socks, socks, wait)
+            for sock in set(writable + failed):
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                target, sockaddr = pending.pop(sock)
+                sock.close()
+                if error == 0 and sock in writable:
+                    return target, sockaddr
+                logger.debug("Connecting to %s port %s failed: %s" % (sockaddr[0], sockaddr[1], error))
+            if not pending:
+                # Everything tried so far failed, do not wait for the next one
+                next_attempt = time.time()
+        return None
+    finally:
+        for sock in pending:
+            sock.close()
+
+
+# Shared by all probes, so names are not looked up again for every run
+RESOLVER = WpkgResolver()
+
+
+class WpkgProbe(object):
+    def __init__(self, targets, resolver=None):
+        self.targets = targets
+        self.resolver = resolver or RESOLVER
+
+    def probe(self, timeout):
+        # One round, returns (target, sockaddr) of the first answer or None
+        started = time.time()
+        resolved = self.resolver.resolve(self.targets, timeout)
+        addresses = interleave(resolved)
+        if not addresses:
+            return None
+        return connect_first(addresses, max(0.1, timeout - (time.time() - started)))
+
+    def wait_ready(self, tries, max_interval, timeout=2, first_timeout=0.5):
+        # Probes until an answer, at most tries rounds. Timeouts and pauses
+        # start short and double up to timeout and max_interval, so a
+        # network that comes up soon is noticed soon.
+        started = time.time()
+        attempt_timeout = first_timeout
+        interval = 0.25
+        for i in range(tries):
+            logger.debug("Testing connection with %s (%i/%i)" %
+                         (", ".join(["%s:%s" % t for t in self.targets]), i + 1, tries))
+            result = self.probe(attempt_timeout)
+            if result != None:
+                (host, port), sockaddr = result
+                logger.info("Network ready after %.2f seconds, %s port %i answered (%s)" %
+                            (time.time() - started, host, port, sockaddr[0]))
+                return True
+            attempt_timeout = min(attempt_timeout * 2, timeout)
+            if i < tries - 1:
+                time.sleep(interval)
+                interval = min(interval * 2, max_interval)
+        logger.info("Network not ready after %.2f seconds" % (time.time() - started))
+        return False
+
+h = NullHandler()
+logger = logging.getLogger("WpkgService")
+logger.addHandler(h)
+
+if __name__=='__main__':
+    import sys
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    logger.setLevel(logging.DEBUG)
+    hosts = len(sys.argv) > 1 and sys.argv[1] or "localhost"
+    ports = len(sys.argv) > 2 and sys.argv[2] or "445"
+    WpkgProbe(parse_targets(hosts, ports)).wait_ready(5, 2)
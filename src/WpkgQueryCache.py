@@ -0,0 +1,72 @@
+"""WpkgQueryCache.py
+Caches the result of the last wpkg.js query
+"""
+import time
+import threading
+
+
+class WpkgFlight(object):
+    # A query in progress. Clients asking for a query while one is running
+    # wait for it and get the same result instead of starting another one.
+    def __init__(self):
+        self.done = threading.Event()
+        self.messages = []
+        self.packages = set()
+
+    def add(self, msg):
+        # Returns False for a package that has already been added, e.g. by
+        # the part of the query run on a mirror that dropped out
+        if msg.startswith("103 "):
+            if msg in self.packages:
+                return False
+            self.packages.add(msg)
+        self.messages.append(msg)
+        return True
+
+    def finish(self):
+        self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        return self.messages
+
+
+class WpkgQueryCache(object):
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.key = None
+        self.time = 0
+        self.messages = None
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0
+
+    def lookup(self, key):
+        # Returns the cached messages for key, or None
+        with self.lock:
+            if self.ttl > 0 and self.messages != None and self.key == key and time.time() - self.time < self.ttl:
+                self.hits = self.hits + 1
+                return list(self.messages)
+            self.misses = self.misses + 1
+            return None
+
+    def store(self, key, messages):
+        with self.lock:
+            self.key = key
+            self.time = time.time()
+            self.messages = list(messages)
+
+    def join(self):
+        # Counts a client sharing the result of a running query
+        with self.lock:
+            self.joined = self.joined + 1
+
+    def invalidate(self):
+        with self.lock:
+            self.key = None
+            self.messages = None
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "joined": self.joined}
@@ -0,0 +1,158 @@
+"""WpkgRunCapture.py
+Keeps the output of a wpkg run with a constant memory footprint
+
+The last lines are kept in memory, everything is streamed to a
+compressed log file in logs\\runs. The log file is written as a series of
+independent gzip members, so it can be read by any gzip tool, and every
+member is listed in an index file next to it:
+
+    <compressed offset> <uncompressed offset> <first line> <timestamp>
+
+This allows reading any part of the run output without decompressing
+the whole file. A member is written every block_size bytes, or when its
+first line is flush_interval seconds old, so the log of a run that hangs
+or takes the service down is on disk.
+"""
+import os
+import gzip
+import time
+import logging
+import threading
+import collections
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+class WpkgRunCapture(object):
+    def __init__(self, logdir, kind="execute", tail=100, block_size=65536, keep=20, flush_interval=5):
+        self.tail = collections.deque(maxlen=tail)
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        # Taken by append and by the thread flushing a run without output
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.buffer = []
+        self.buffered = 0
+        self.block_time = None
+        self.lines = 0
+        self.offset = 0
+        self.first_line = 0
+        self.file = None
+        self.index = None
+        self.rundir = os.path.join(logdir, "runs")
+        started = time.strftime("%Y%m%d-%H%M%S")
+        self.set_run_id(started, kind)
+        try:
+            if not os.path.isdir(self.rundir):
+                os.makedirs(self.rundir)
+            self.prune(kind, keep - 1)
+            # Runs started within the same second get a counter, which sorts
+            # after the first run of that second
+            i = 1
+            while os.path.exists(self.path) or os.path.exists(self.index_path):
+                i = i + 1
+                self.set_run_id("%s.%i" % (started, i), kind)
+            self.file = open(self.path, "wb")
+            self.index = open(self.index_path, "w")
+        except (IOError, OSError), e:
+            # Keep on running with the in memory tail only
+            logger.error("Unable to create run log %s: %s" % (self.path, e))
+            self.close_files()
+        if self.file != None and self.flush_interval > 0:
+            self.thread = threading.Thread(target=self.run, name="WpkgRunCapture")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def append(self, line):
+        with self.lock:
+            self.tail.append(line)
+            self.lines = self.lines + 1
+            if self.file == None:
+                return
+            if self.block_time == None:
+                self.block_time = time.time()
+            self.buffer.append(line)
+            self.buffered = self.buffered + len(line)
+            if self.buffered >= self.block_size or self.is_due():
+                self.flush_block()
+
+    def is_due(self):
+        return (self.flush_interval > 0 and self.block_time != None and
+                time.time() - self.block_time >= self.flush_interval)
+
+    def run(self):
+        # Writes the lines of a run that stopped writing output
+        while not self.stopped.wait(1):
+            with self.lock:
+                if self.file != None and self.is_due():
+                    self.flush_block()
+
+    def flush_block(self):
+        if not self.buffer:
+            return
+        data = "".join(self.buffer)
+        try:
+            compressed_offset = self.file.tell()
+            member = gzip.GzipFile(fileobj=self.file, mode="wb")
+            member.write(data)
+            member.close() # Ends the member, leaves self.file open
+            self.file.flush()
+            self.index.write("%i %i %i %.3f\n" % (compressed_offset, self.offset, self.first_line, self.block_time))
+            self.index.flush()
+        except (IOError, OSError), e:
+            logger.error("Unable to write run log %s: %s" % (self.path, e))
+            self.close_files()
+        self.offset = self.offset + len(data)
+        self.first_line = self.lines
+        self.buffer = []
+        self.buffered = 0
+        self.block_time = None
+
+    def last_line(self):
+        if self.tail:
+            return self.tail[-1].rstrip("\n")
+        return ""
+
+    def close(self):
+        self.stopped.set()
+        if self.thread != None:
+            self.thread.join(5)
+        with self.lock:
+            if self.file != None:
+                self.flush_block()
+            self.close_files()
+
+    def close_files(self):
+        for f in (self.file, self.index):
+            if f != None:
+                try:
+                    f.close()
+                except (IOError, OSError):
+                    pass
+        self.file = None
+        self.index = None
+
+    def set_run_id(self, started, kind):
+        self.run_id = "%s-%s" % (started, kind)
+        self.path = os.path.join(self.rundir, self.run_id + ".log.gz")
+        self.index_path = os.path.join(self.rundir, self.run_id + ".idx")
+
+    def prune(self, kind, keep):
+        # Removes the oldest run logs of this kind, so that only keep remain
+        suffix = "-%s.log.gz" % kind
+        logs = sorted([f for f in os.listdir(self.rundir) if f.endswith(suffix)])
+        for name in logs[:max(0, len(logs) - keep)]:
+            run_id = name[:-len(".log.gz")]
+            for path in (name, run_id + ".idx"):
+                try:
+                    os.remove(os.path.join(self.rundir, path))
+                except OSError:
+                    pass
+
+h = NullHandler()
+logger = logging.getLogger("WpkgService")
+logger.addHandler(h)
@@ -0,0 +1,203 @@
+"""WpkgTiming.py
+Measures where the service spends its time during startup and runs
+
+A run activates its WpkgTiming on the thread performing it. Code called
+by the run, e.g. the network handler, measures its steps with span() and
+mark() without knowing about the run. Without an active timing these
+return at once, so they can stay in place when timings are disabled.
+"""
+import sys
+import time
+import threading
+import contextlib
+import __builtin__
+
+# The timing of the run performed by the current thread
+_active = threading.local()
+
+
+class NoSpan(object):
+    # Returned by span() when no timing is active
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NO_SPAN = NoSpan()
+
+
+def current():
+    return getattr(_active, "timing", None)
+
+
+def span(name):
+    # with span("connect"): ... measures the block in the active timing
+    timing = getattr(_active, "timing", None)
+    if timing == None:
+        return NO_SPAN
+    return timing.stage(name)
+
+
+def mark(name):
+    # Records the moment name happened in the active timing
+    timing = getattr(_active, "timing", None)
+    if timing != None:
+        timing.mark(name)
+
+
+class WpkgTiming(object):
+    def __init__(self, name="Startup"):
+        self.name = name
+        self.started = time.time()
+        self.finished = None
+        self.lock = threading.Lock()
+        self.stages = [] # [name, offset, seconds, depth, count], count 0 for marks
+        self.totals = {} # (name, depth) -> stage summing up many short steps
+        self.modules = {} # module name -> seconds spent importing it, without its imports
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def activate(self):
+        # Makes this the timing span() and mark() use on this thread
+        previous = current()
+        _active.timing = self
+        try:
+            yield self
+        finally:
+            _active.timing = previous
+            self.finished = time.time()
+
+    def start(self, name):
+        depth = getattr(self.local, "depth", 0)
+        self.local.depth = depth + 1
+        entry = [name, time.time() - self.started, None, depth, 1]
+        with self.lock:
+            self.stages.append(entry)
+        return entry
+
+    def finish(self, entry):
+        entry[2] = time.time() - self.started - entry[1]
+        self.local.depth = entry[3]
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        entry = self.start(name)
+        try:
+            yield
+        finally:
+            self.finish(entry)
+
+    def record(self, name, seconds, started=None):
+        # A stage measured by the caller
+        if started == None:
+            started = time.time() - seconds
+        with self.lock:
+            self.stages.append([name, started - self.started, seconds, getattr(self.local, "depth", 0), 1])
+
+    def add(self, name, seconds, started=None):
+        # Adds seconds to the stage name, for many steps too short to list
+        # one by one
+        if started == None:
+            started = time.time() - seconds
+        key = (name, getattr(self.local, "depth", 0))
+        with self.lock:
+            entry = self.totals.get(key)
+            if entry == None:
+                entry = self.totals[key] = [name, started - self.started, 0, key[1], 0]
+                self.stages.append(entry)
+            entry[2] = entry[2] + seconds
+            entry[4] = entry[4] + 1
+
+    def mark(self, name):
+        with self.lock:
+            self.stages.append([name, time.time() - self.started, None, getattr(self.local, "depth", 0), 0])
+
+    @contextlib.contextmanager
+    def imports(self):
+        # Measures every module imported for the first time within the block
+        original = __builtin__.__import__
+        def timed_import(name, *args, **kwargs):
+            if not name or name in sys.modules:
+                return original(name, *args, **kwargs)
+            stack = self.local.__dict__.setdefault("stack", [])
+            stack.append(0.0) # Time spent in nested imports
+            started = time.time()
+            try:
+                return original(name, *args, **kwargs)
+            finally:
+                elapsed = time.time() - started
+                nested = stack.pop()
+                if stack:
+                    stack[-1] = stack[-1] + elapsed
+                with self.lock:
+                    self.modules[name] = self.modules.get(name, 0) + elapsed - nested
+        __builtin__.__import__ = timed_import
+        try:
+            yield
+        finally:
+            __builtin__.__import__ = original
+
+    def report(self, modules=10):
+        with self.lock:
+            stages = sorted([list(entry) for entry in self.stages], key=lambda entry: entry[1])
+            slowest = sorted(self.modules.items(), key=lambda item: item[1], reverse=True)[:modules]
+        lines = ["%s timing (%.1f ms since start):" % (self.name, ((self.finished or time.time()) - self.started) * 1000)]
+        for name, offset, seconds, depth, count in stages:
+            name = "  " * depth + name
+            if count == 0:
+                lines.append("  %-40s at %8.1f ms" % (name, offset * 1000))
+            elif seconds == None:
+                lines.append("  %-40s    running" % name)
+            elif count > 1:
+                lines.append("  %-40s %11.1f ms (%i times)" % (name, seconds * 1000, count))
+            else:
+                lines.append("  %-40s %11.1f ms" % (name, seconds * 1000))
+        if slowest:
+            lines.append("Slowest imports:")
+            for name, seconds in slowest:
+                lines.append("  %-40s %11.1f ms" % (name, seconds * 1000))
+        return "\n".join(lines)
+
+
+class WpkgStepTimer(object):
+    # Times a sequence of steps, e.g. the packages of a run. Steps taking at
+    # least min_seconds get a stage of their own, shorter ones are added up
+    # per group.
+    def __init__(self, timing, min_seconds=0.5):
+        self.timing = timing
+        self.min_seconds = min_seconds
+        self.step = None # (name, group, started)
+
+    def next(self, name, group):
+        # Starts the step name, unless it is the current one
+        if self.step != None and self.step[0] == name:
+            return
+        now = time.time()
+        self.close(now)
+        self.step = (name, group, now)
+
+    def close(self, now=None):
+        if self.step == None:
+            return
+        if now == None:
+            now = time.time()
+        name, group, started = self.step
+        self.step = None
+        if now - started >= self.min_seconds:
+            self.timing.record(name, now - started, started)
+        else:
+            self.timing.add(group, now - started, started)
+
+
+if __name__=='__main__':
+    # Reports the import cost of the modules the service loads in the background
+    timing = WpkgTiming("Import")
+    with timing.imports():
+        for name in sys.argv[1:] or ["WpkgExecuter", "WpkgLGPUpdater", "WpkgTranslator"]:
+            with timing.stage("import " + name):
+                try:
+                    __import__(name)
+                except ImportError, e:
+                    print "Unable to import %s: %s" % (name, e)
+    print timing.report(20)
@@ -0,0 +1,98 @@
+"""WpkgWatchdog.py
+Kills a wpkg run that takes too long or stopped producing output
+"""
+import time
+import logging
+import threading
+import subprocess
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+def kill_tree(proc):
+    # Kills the process and every process it started, e.g. a hung installer
+    # started by wpkg.js. Falls back to killing the process only.
+    try:
+        if subprocess.call("taskkill /F /T /PID %i" % proc.pid) == 0:
+            return True
+    except OSError, e:
+        logger.debug("Unable to run taskkill: %s" % e)
+    try:
+        proc.kill()
+        return True
+    except OSError, e:
+        logger.error("Unable to kill process %i: %s" % (proc.pid, e))
+    return False
+
+
+class WpkgWatchdog(object):
+    # All limits are in seconds, 0 disables a limit.
+    #   stall:   no output from the process for this long
+    #   run:     the whole run takes longer than this
+    #   package: a single package takes longer than this
+    def __init__(self, proc, stall=0, run=0, package=0, interval=10):
+        self.proc = proc
+        self.limits = {"stall": stall, "run": run, "package": package}
+        self.interval = interval
+        self.started = time.time()
+        self.last_output = self.started
+        self.package = None
+        self.package_started = self.started
+        self.stopped = False
+        self.expired = None # The limit that was hit
+        self.expired_package = None
+        if stall > 0 or run > 0 or package > 0:
+            t = threading.Thread(target=self.run)
+            t.daemon = True
+            t.start()
+
+    def activity(self, package=None):
+        # Called for every line of output, with the package wpkg.js works on
+        now = time.time()
+        self.last_output = now
+        if package != None and package != self.package:
+            self.package = package
+            self.package_started = now
+
+    def deadlines(self):
+        deadlines = []
+        if self.limits["stall"] > 0:
+            deadlines.append((self.last_output + self.limits["stall"], "stall"))
+        if self.limits["run"] > 0:
+            deadlines.append((self.started + self.limits["run"], "run"))
+        if self.limits["package"] > 0 and self.package != None:
+            deadlines.append((self.package_started + self.limits["package"], "package"))
+        return deadlines
+
+    def run(self):
+        while 1:
+            # Sleeps until the nearest deadline, output moves the deadlines
+            # forward so they are checked again when waking up
+            deadlines = self.deadlines()
+            now = time.time()
+            if deadlines:
+                deadline, reason = min(deadlines)
+                if deadline <= now:
+                    break
+                time.sleep(min(deadline - now, self.interval))
+            else:
+                time.sleep(self.interval)
+            if self.stopped:
+                return
+        if self.stopped:
+            return
+        self.expired = reason
+        self.expired_package = self.package
+        logger.error("Watchdog: %s limit of %i seconds reached%s, killing WPKG" %
+                     (reason, self.limits[reason], self.package and " on package %s" % self.package or ""))
+        kill_tree(self.proc)
+
+    def stop(self):
+        self.stopped = True
+
+h = NullHandler()
+logger = logging.getLogger("WpkgService")
+logger.addHandler(h)
@@ -0,0 +1,80 @@
+"""WpkgWorkerPool.py
+A fixed size pool of worker threads serving pipe clients
+"""
+import logging
+import threading
+import time
+
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full  # python 3.x
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+class WpkgWorkerPool(object):
+    def __init__(self, workers=16, backlog=64):
+        # Jobs waiting for a free worker are kept in a bounded queue, so a
+        # burst of clients can never spawn more threads than configured.
+        self.queue = Queue(backlog)
+        self.threads = []
+        self.busy = 0
+        self.lock = threading.Lock()
+        for i in range(workers):
+            t = threading.Thread(target=self.worker, name="WpkgWorker-%i" % i)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def worker(self):
+        while 1:
+            job = self.queue.get()
+            if job is None: # Shutdown
+                self.queue.task_done()
+                return
+            fn, args = job
+            with self.lock:
+                self.busy = self.busy + 1
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception("Unhandled error in worker thread:")
+            with self.lock:
+                self.busy = self.busy - 1
+            self.queue.task_done()
+
+    def submit(self, fn, *args):
+        # Returns False if all workers are busy and the backlog is full
+        try:
+            self.queue.put_nowait((fn, args))
+        except Full:
+            return False
+        return True
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def stop(self):
+        # Lets the workers finish the queued jobs, then stops them
+        for t in self.threads:
+            self.queue.put(None)
+
+    def join(self, timeout=None):
+        # Returns the number of worker threads still running
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        for t in self.threads:
+            if deadline is None:
+                t.join()
+            else:
+                t.join(max(0, deadline - time.time()))
+        return len([t for t in self.threads if t.is_alive()])
+
+h = NullHandler()
+logger = logging.getLogger("WpkgService")
+logger.addHandler(h)
@@ -1,33 +1,183 @@
-# -*- encoding: utf-8 -*-
-import sys
-import logging
-import win32file
-import pywintypes
-
-class NullHandler(logging.Handler):
-    def emit(self, record):
-        pass
-
-class WpkgWriter():
-    def __init__(self, handle=None):
-        self.handle = handle
-
-    def Write(self, string):
-        logger.debug(R"Writing '%s' to pipe" % string)
-        if self.handle != None:
-            try:
-                #win32file.WriteFile(self.handle, string.decode('iso8859_15').encode('iso8859_15'))
-                win32file.WriteFile(self.handle, string.decode('utf-8').encode('utf-8'))
-                return True
-            except pywintypes.error, (n, f, e):
-                if n == 232 or n == 109: #The pipe is being closed (in the other end)
-                    logger.warning("A client closed the pipe unexpectedly.")
-                    return 1
-                else:
-                    raise
-        else:
-            print string
-
-h = NullHandler()
-logger = logging.getLogger("WpkgService")
-logger.addHandler(h)
+# -*- encoding: utf-8 -*-
+import sys
+import logging
+import threading
+import collections
+import win32file, win32event, winerror
+import pywintypes
+import WpkgMetrics
+
+# Seconds a client may stop reading before it is considered dead
+WRITE_TIMEOUT = 60
+# Number of queued messages before progress messages are dropped
+QUEUE_LENGTH = 64
+
+# Messages waiting in the queues of all writers
+QUEUE_DEPTH = WpkgMetrics.METRICS.gauge("wpkggp_writer_queue_depth")
+MESSAGES = WpkgMetrics.METRICS.counter("wpkggp_writer_messages_total")
+DROPPED = WpkgMetrics.METRICS.counter("wpkggp_writer_dropped_total")
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+def is_progress(data):
+    # 100 and 101 messages are superseded by the next one
+    return data[0:3] in ("100", "101")
+
+class WpkgWriter():
+    def __init__(self, handle=None, broadcaster=None, timeout=WRITE_TIMEOUT):
+        self.handle = handle
+        self.broadcaster = broadcaster
+        self.timeout = timeout
+        self.closed = False
+        # Messages are written to the pipe by a separate thread, so a slow
+        # client never blocks the task producing the messages
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.sending = False
+        self.stopping = False
+        self.thread = None
+        self.finished = False
+        self.on_closed = None
+
+    def Write(self, string):
+        logger.debug(R"Writing '%s' to pipe", string)
+        #data = string.decode('iso8859_15').encode('iso8859_15')
+        data = string.decode('utf-8').encode('utf-8')
+        if self.broadcaster != None:
+            self.broadcaster.publish(data)
+        return self.WriteEncoded(data)
+
+    def WriteEncoded(self, data):
+        if self.handle == None:
+            print data
+            return True
+        with self.cond:
+            if self.closed:
+                return 1
+            MESSAGES.inc()
+            if self.queue and is_progress(data) and is_progress(self.queue[-1]):
+                # Latest wins
+                self.queue[-1] = data
+                DROPPED.inc()
+            else:
+                self.queue.append(data)
+                QUEUE_DEPTH.inc()
+                if len(self.queue) > QUEUE_LENGTH:
+                    self.drop_progress()
+            if self.thread == None:
+                self.thread = threading.Thread(target=self.run, name="WpkgWriter")
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify()
+        return True
+
+    def drop_progress(self):
+        # Never drops anything but progress messages
+        for data in list(self.queue):
+            if len(self.queue) <= QUEUE_LENGTH:
+                break
+            if is_progress(data):
+                self.queue.remove(data)
+                QUEUE_DEPTH.dec()
+                DROPPED.inc()
+
+    def run(self):
+        overlapped = pywintypes.OVERLAPPED()
+        overlapped.hEvent = win32event.CreateEvent(None, 1, 0, None)
+        try:
+            while 1:
+                with self.cond:
+                    while not self.queue and not self.stopping:
+                        self.cond.wait()
+                    if not self.queue:
+                        return
+                    data = self.queue.popleft()
+                    QUEUE_DEPTH.dec()
+                    self.sending = True
+                try:
+                    self.send(data, overlapped)
+                finally:
+                    with self.cond:
+                        self.sending = False
+                        self.cond.notify_all()
+                if self.closed:
+                    return
+        finally:
+            win32file.CloseHandle(overlapped.hEvent)
+            with self.cond:
+                self.finished = True
+                on_closed = self.on_closed
+            if on_closed != None:
+                on_closed()
+
+    def send(self, data, overlapped):
+        try:
+            win32event.ResetEvent(overlapped.hEvent)
+            win32file.WriteFile(self.handle, data, overlapped)
+            rc = win32event.WaitForSingleObject(overlapped.hEvent, int(self.timeout * 1000))
+            if rc == win32event.WAIT_TIMEOUT:
+                win32file.CancelIo(self.handle)
+                try:
+                    # Wait for the cancellation before the buffer is released
+                    win32file.GetOverlappedResult(self.handle, overlapped, True)
+                except pywintypes.error:
+                    pass
+                logger.warning("A client did not read from the pipe for %i seconds, dropping it." % self.timeout)
+                self.set_closed()
+                return
+            win32file.GetOverlappedResult(self.handle, overlapped, False)
+        except pywintypes.error, (n, f, e):
+            if n == 232 or n == 109 or n == winerror.ERROR_OPERATION_ABORTED: #The pipe is being closed (in the other end)
+                logger.warning("A client closed the pipe unexpectedly.")
+                self.set_closed()
+            else:
+                logger.exception("Error when writing to pipe:")
+                self.set_closed()
+
+    def set_closed(self):
+        with self.cond:
+            self.closed = True
+            QUEUE_DEPTH.dec(len(self.queue))
+            self.queue.clear()
+            self.cond.notify_all()
+
+    def pending(self):
+        return len(self.queue)
+
+    def wait(self, limit):
+        # Blocks while more than limit messages are queued, keeps the memory
+        # of large transfers to a slow client small
+        with self.cond:
+            while len(self.queue) > limit and not self.closed:
+                self.cond.wait(1)
+
+    def close(self):
+        # Waits until the queued messages are written, or the client is
+        # found dead. Must be called before the pipe handle is closed.
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+            while (self.queue or self.sending) and not self.closed:
+                self.cond.wait(1)
+        if self.thread != None:
+            self.thread.join()
+        self.closed = True
+
+    def close_async(self, callback=None):
+        # Like close(), but returns at once. callback is called by the writer
+        # thread once the queued messages are written, e.g. to close the pipe.
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+            if self.thread != None and not self.finished:
+                self.on_closed = callback
+                return
+        self.closed = True
+        if callback != None:
+            callback()
+
+h = NullHandler()
+logger = logging.getLogger("WpkgService")
+logger.addHandler(h)